@@ -0,0 +1,12 @@
+# Load the application (and the memory-mapped NLP artifacts) once in the
+# master process, so the forked workers share its read-only pages instead
+# of each loading the model again.
+preload_app = True
+
+
+def post_fork(server, worker):
+    # A model load still running in the master when the worker was forked
+    # does not survive the fork; restart it in the worker.
+    from api.controllers.nlp_recommendations import nlp_model_holder
+
+    nlp_model_holder.start()
@@ -0,0 +1,71 @@
+from api import db
+from api.models import Genre, Movie, Serie, MovieGenre, SerieGenre
+from api.models.genre import split_genres
+from api.utils import min_age_expression
+
+# Catalog model, genre link model and title id column of each item type
+CATALOG_MODELS = {
+    "movie": (Movie, MovieGenre, MovieGenre.movie_id),
+    "serie": (Serie, SerieGenre, SerieGenre.serie_id),
+}
+
+
+def sync_genres(item_type):
+    """
+    Rebuild the genre links of a catalog table from its `genres` column, and
+    add the genres that are not in the `genres` table yet.
+
+    The links also copy the popularity of the titles, so this must run again
+    after the catalog is imported or its popularity is updated.
+
+    Args:
+        item_type (str): "movie" or "serie".
+
+    Returns:
+        int: The number of links written.
+    """
+    model, link_model, item_id = CATALOG_MODELS[item_type]
+    titles = db.session.query(model.id, model.genres, model.popularity).all()
+
+    genre_ids = dict(db.session.query(Genre.name, Genre.id))
+    for _, genres, _ in titles:
+        for name in split_genres(genres):
+            if name not in genre_ids:
+                genre = Genre(name=name)
+                db.session.add(genre)
+                db.session.flush()
+                genre_ids[name] = genre.id
+
+    links = [
+        {item_id.key: title_id, "genre_id": genre_ids[name], "popularity": popularity}
+        for title_id, genres, popularity in titles
+        for name in split_genres(genres)
+    ]
+    db.session.query(link_model).delete()
+    if links:
+        db.session.execute(link_model.__table__.insert(), links)
+    db.session.commit()
+    return len(links)
+
+
+def sync_min_ages(item_type):
+    """
+    Set the `min_age` column of a catalog table from its age ratings, for
+    titles written without the models, e.g. by a catalog import, which get
+    the server default of 18.
+
+    Args:
+        item_type (str): "movie" or "serie".
+
+    Returns:
+        int: The number of titles updated.
+    """
+    model = CATALOG_MODELS[item_type][0]
+    min_age = min_age_expression(model.age_rating)
+    count = (
+        db.session.query(model)
+        .filter(model.min_age != min_age)
+        .update({model.min_age: min_age}, synchronize_session=False)
+    )
+    db.session.commit()
+    return count
@@ -0,0 +1,424 @@
+import os
+import timeit
+import click
+import numpy as np
+from flask.cli import AppGroup
+from scipy import sparse
+
+from api.utils import top_k_indices
+from api.nlp.tfidf import TfidfCatalog
+from api.nlp import (
+    SimilarityEngine,
+    COMPONENTS,
+    DEFAULT_PRECISION,
+    build_neighbor_index,
+    build_ivf_index,
+    measure_recall,
+    export_model,
+    IVFIndex,
+    DEFAULT_NEIGHBORS,
+    DEFAULT_BLOCK_SIZE,
+    DEFAULT_TARGET_RECALL,
+    NEIGHBORS_DIR,
+    load_model,
+    load_raw_embedding,
+    version_dir,
+    current_version,
+    list_versions,
+    publish_version,
+    check_version_name,
+)
+
+
+def load_raw_embeddings(resources_dir):
+    # Embeddings originais (.npy ou .npz), necessários para as comparações
+    try:
+        return {name: load_raw_embedding(resources_dir, name) for name in COMPONENTS}
+    except FileNotFoundError:
+        raise click.ClickException(
+            "The original *_process.npy or *_process.npz files are required"
+        )
+
+
+def setup_commands(app):
+    """
+    Register the custom `flask` CLI commands of the API.
+
+    Commands:
+        flask nlp build-index: Precompute the top-K neighbors of every title
+            of the NLP catalog and store them next to the NLP resources.
+        flask nlp export: Write the NLP catalog and normalized embeddings as
+            `.npy` files that the workers open memory-mapped.
+        flask nlp build-ann: Build the IVF approximate nearest-neighbor index
+            of the NLP catalog and calibrate it for a target recall.
+        flask nlp publish: Make a version of the NLP artifacts the one
+            loaded by the workers.
+        flask nlp versions: List the versions of the NLP artifacts.
+        flask tfidf build: Fit the TF-IDF models of the movies and series
+            used by the recommenders, if the catalog changed.
+        flask catalog sync: Rebuild the genre links and minimum ages of the
+            movies and series from their genres and age rating columns.
+        flask bench top-k: Compare the partial top-k selection used by the
+            recommenders with a full sort of the scores.
+        flask bench ann: Compare the recall and latency of the IVF index
+            with the exact search.
+        flask bench precision: Check that the top-10 rankings of the
+            float32 and int8 embeddings stay stable against float64.
+        flask bench sparse: Compare the size and scoring time of the dense
+            and CSR sparse embeddings.
+    """
+    nlp_cli = AppGroup("nlp", help="Manage the NLP recommendation artifacts.")
+
+    version_option = click.option(
+        "--version",
+        help="Version of the artifacts to use. [default: the served one]",
+    )
+
+    def versioned_model(version):
+        # Modelo e diretório de uma versão, ou da versão servida pela aplicação
+        from api.controllers.nlp_recommendations import (
+            nlp_model_holder,
+            nlp_resources_dir,
+            load_nlp_model,
+        )
+
+        if version is None:
+            nlp_model = nlp_model_holder.wait()
+            return nlp_model, version_dir(nlp_resources_dir, nlp_model_holder.version)
+
+        try:
+            resources_dir = version_dir(nlp_resources_dir, version)
+        except ValueError as e:
+            raise click.ClickException(str(e))
+        if not os.path.isdir(resources_dir):
+            raise click.ClickException(
+                f"Unknown version {version}: create it with flask nlp export"
+            )
+        return load_nlp_model(version), resources_dir
+
+    @nlp_cli.command("build-index")
+    @click.option(
+        "--k",
+        default=DEFAULT_NEIGHBORS,
+        show_default=True,
+        help="Neighbors kept per title.",
+    )
+    @click.option(
+        "--block-size",
+        default=DEFAULT_BLOCK_SIZE,
+        show_default=True,
+        help="Titles scored per block.",
+    )
+    @version_option
+    def build_index(k, block_size, version):
+        nlp_model, resources_dir = versioned_model(version)
+        index = build_neighbor_index(
+            nlp_model.engine, nlp_model.catalog.ids, k=k, block_size=block_size
+        )
+        index_dir = os.path.join(resources_dir, NEIGHBORS_DIR)
+        index.save(index_dir)
+        click.echo(
+            f"Neighbor index with {index.rows.shape[1]} neighbors per title written to "
+            f"{os.path.relpath(index_dir)}"
+        )
+
+    @nlp_cli.command("export")
+    @click.option(
+        "--version",
+        help="Build a new version from the original files instead of "
+        "rewriting the served one.",
+    )
+    def export(version):
+        from api.controllers.nlp_recommendations import (
+            nlp_model_holder,
+            nlp_resources_dir,
+        )
+
+        if version is None:
+            nlp_model = nlp_model_holder.wait()
+            resources_dir = version_dir(nlp_resources_dir, nlp_model_holder.version)
+        else:
+            try:
+                resources_dir = version_dir(nlp_resources_dir, version)
+            except ValueError as e:
+                raise click.ClickException(str(e))
+            nlp_model = load_model(
+                nlp_resources_dir,
+                precision=os.getenv("NLP_PRECISION", DEFAULT_PRECISION),
+                compiled=False,
+            )
+
+        compiled_dir = export_model(nlp_model, resources_dir)
+        click.echo(
+            f"Memory-mappable NLP artifacts written to {os.path.relpath(compiled_dir)}"
+        )
+        if version is not None:
+            click.echo(f"Publish them with: flask nlp publish {version}")
+
+    @nlp_cli.command("build-ann")
+    @click.option("--nlist", type=int, help="Number of clusters. [default: sqrt(N)]")
+    @click.option(
+        "--target-recall",
+        default=DEFAULT_TARGET_RECALL,
+        show_default=True,
+        help="Recall@10 the default nprobe must reach.",
+    )
+    @version_option
+    def build_ann(nlist, target_recall, version):
+        nlp_model, resources_dir = versioned_model(version)
+        index = build_ivf_index(
+            nlp_model.engine,
+            nlp_model.catalog.ids,
+            nlist=nlist,
+            target_recall=target_recall,
+        )
+        index_dir = os.path.join(resources_dir, IVFIndex.name)
+        index.save(index_dir)
+        click.echo(
+            f"IVF index with {index.nlist} clusters written to "
+            f"{os.path.relpath(index_dir)} (nprobe={index.nprobe}, "
+            f"recall@10={index.recall:.3f})"
+        )
+
+    @nlp_cli.command("publish")
+    @click.argument("version")
+    def publish(version):
+        from api.controllers.nlp_recommendations import nlp_resources_dir
+
+        try:
+            check_version_name(version)
+            publish_version(nlp_resources_dir, version)
+        except ValueError as e:
+            raise click.ClickException(str(e))
+        click.echo(
+            f"Published version {version}; the workers load it within "
+            f"NLP_RELOAD_INTERVAL seconds or on POST /api/nlp-recommendations/reload"
+        )
+
+    @nlp_cli.command("versions")
+    def versions():
+        from api.controllers.nlp_recommendations import nlp_resources_dir
+
+        published = current_version(nlp_resources_dir)
+        for version in list_versions(nlp_resources_dir):
+            click.echo(f"{'*' if version == published else ' '} {version}")
+
+    tfidf_cli = AppGroup("tfidf", help="Manage the TF-IDF catalog models.")
+
+    @tfidf_cli.command("build")
+    @click.option(
+        "--force",
+        is_flag=True,
+        help="Fit the models even if the catalog did not change.",
+    )
+    def build_tfidf(force):
+        from api.tfidf_store import movie_tfidf, serie_tfidf
+
+        for store in (movie_tfidf, serie_tfidf):
+            fingerprint = store.fingerprint()
+            if not force and os.path.exists(store.path):
+                if store.is_current(TfidfCatalog.load(store.path), fingerprint):
+                    click.echo(f"{os.path.relpath(store.path)} is up to date")
+                    continue
+            catalog = store.build()
+            click.echo(
+                f"TF-IDF model of {len(catalog)} titles with "
+                f"{catalog.matrix.shape[1]} terms written to {os.path.relpath(store.path)}"
+            )
+
+    catalog_cli = AppGroup("catalog", help="Manage the derived catalog data.")
+
+    @catalog_cli.command("sync")
+    def sync_catalog():
+        from api.catalog import CATALOG_MODELS, sync_genres, sync_min_ages
+
+        for item_type in CATALOG_MODELS:
+            count = sync_genres(item_type)
+            click.echo(f"{count} {item_type} genre links written")
+            count = sync_min_ages(item_type)
+            click.echo(f"Minimum age of {count} {item_type} titles updated")
+
+    bench_cli = AppGroup("bench", help="Benchmark the recommendation hot paths.")
+
+    @bench_cli.command("top-k")
+    @click.option("--size", default=10000, show_default=True, help="Catalog size.")
+    @click.option("--k", default=30, show_default=True, help="Items selected.")
+    @click.option("--repeat", default=20, show_default=True, help="Runs per method.")
+    def bench_top_k(size, k, repeat):
+        rng = np.random.default_rng(0)
+        scores = rng.random(size)
+        mask = rng.random(size) < 0.5
+
+        def list_sort():
+            sim_scores = sorted(enumerate(scores), key=lambda x: x[1], reverse=True)
+            return [i for i, _ in sim_scores if mask[i]][:k]
+
+        def partial_top_k():
+            return top_k_indices(scores, k, mask).tolist()
+
+        if list_sort() != partial_top_k():
+            raise click.ClickException("Top-k selection differs from the full sort")
+
+        sort_ms = min(timeit.repeat(list_sort, number=1, repeat=repeat)) * 1000
+        top_k_ms = min(timeit.repeat(partial_top_k, number=1, repeat=repeat)) * 1000
+        click.echo(f"list sort:     {sort_ms:8.3f} ms")
+        click.echo(f"partial top-k: {top_k_ms:8.3f} ms")
+        click.echo(f"speedup:       {sort_ms / top_k_ms:8.1f}x")
+
+    @bench_cli.command("ann")
+    @click.option(
+        "--nprobe",
+        default="1,2,4,8,16",
+        show_default=True,
+        help="Comma-separated numbers of probed clusters.",
+    )
+    @click.option("--queries", default=200, show_default=True, help="Sampled queries.")
+    @click.option(
+        "--min-recall",
+        default=DEFAULT_TARGET_RECALL,
+        show_default=True,
+        help="Fail if the calibrated nprobe recalls less than this.",
+    )
+    def bench_ann(nprobe, queries, min_recall):
+        from api.controllers.nlp_recommendations import (
+            nlp_model_holder,
+            nlp_resources_dir,
+        )
+
+        engine = nlp_model_holder.wait().engine
+        resources_dir = version_dir(nlp_resources_dir, nlp_model_holder.version)
+        index_dir = os.path.join(resources_dir, IVFIndex.name)
+        if not os.path.isdir(index_dir):
+            raise click.ClickException("Build the index first: flask nlp build-ann")
+
+        index = IVFIndex.load(index_dir)
+        rng = np.random.default_rng(0)
+        sample = rng.choice(engine.size, min(queries, engine.size), replace=False)
+        mask = np.ones(engine.size, dtype=bool)
+
+        def exact():
+            for idx in sample:
+                top_k_indices(engine.similarity_row(idx), 10, mask)
+
+        exact_ms = timeit.timeit(exact, number=1) * 1000 / len(sample)
+        click.echo(f"exact:       recall@10=1.000  {exact_ms:8.3f} ms/query")
+
+        for probes in sorted({int(n) for n in nprobe.split(",")} | {index.nprobe}):
+
+            def approximate():
+                for idx in sample:
+                    index.search(engine, idx, mask, 10, nprobe=probes)
+
+            recall = measure_recall(engine, index, probes, queries=queries)
+            ann_ms = timeit.timeit(approximate, number=1) * 1000 / len(sample)
+            default = " (default)" if probes == index.nprobe else ""
+            click.echo(
+                f"nprobe={probes:<4} recall@10={recall:.3f}  {ann_ms:8.3f} ms/query"
+                f"{default}"
+            )
+            if probes == index.nprobe and recall < min_recall:
+                raise click.ClickException(
+                    f"Recall {recall:.3f} of the default nprobe is below {min_recall}"
+                )
+
+    @bench_cli.command("precision")
+    @click.option(
+        "--precision",
+        "precisions",
+        default="float32,int8",
+        show_default=True,
+        help="Comma-separated precisions to compare with float64.",
+    )
+    @click.option("--queries", default=200, show_default=True, help="Sampled queries.")
+    @click.option(
+        "--min-overlap",
+        default=0.9,
+        show_default=True,
+        help="Fail if a precision keeps less than this share of the top-10.",
+    )
+    def bench_precision(precisions, queries, min_overlap):
+        from api.controllers.nlp_recommendations import nlp_resources_dir
+
+        embeddings = load_raw_embeddings(nlp_resources_dir)
+
+        reference = SimilarityEngine(embeddings, precision="float64")
+        rng = np.random.default_rng(0)
+        sample = rng.choice(reference.size, min(queries, reference.size), replace=False)
+        mask = np.ones(reference.size, dtype=bool)
+
+        def rankings(engine):
+            result = []
+            for idx in sample:
+                mask[idx] = False
+                result.append(top_k_indices(engine.similarity_row(idx), 10, mask))
+                mask[idx] = True
+            return result
+
+        expected = rankings(reference)
+        click.echo(f"float64: {reference.nbytes / 2**20:8.1f} MiB")
+
+        failed = []
+        for precision in precisions.split(","):
+            engine = SimilarityEngine(embeddings, precision=precision)
+            got = rankings(engine)
+            overlap = np.mean(
+                [len(np.intersect1d(e, g)) / 10 for e, g in zip(expected, got)]
+            )
+            same_order = np.mean([np.array_equal(e, g) for e, g in zip(expected, got)])
+            click.echo(
+                f"{precision}: {engine.nbytes / 2**20:8.1f} MiB  "
+                f"top-10 overlap={overlap:.3f}  same order={same_order:.3f}"
+            )
+            if overlap < min_overlap:
+                failed.append(precision)
+
+        if failed:
+            raise click.ClickException(
+                f"Top-10 overlap below {min_overlap} for: {', '.join(failed)}"
+            )
+
+    @bench_cli.command("sparse")
+    @click.option("--queries", default=200, show_default=True, help="Sampled queries.")
+    def bench_sparse(queries):
+        from api.controllers.nlp_recommendations import nlp_resources_dir
+
+        embeddings = load_raw_embeddings(nlp_resources_dir)
+        dense = {
+            name: matrix.toarray() if sparse.issparse(matrix) else matrix
+            for name, matrix in embeddings.items()
+        }
+        csr = {name: sparse.csr_matrix(matrix) for name, matrix in dense.items()}
+        for name in COMPONENTS:
+            density = csr[name].nnz / max(1, np.prod(csr[name].shape))
+            click.echo(f"{name}: density={density:.4f}")
+
+        rng = np.random.default_rng(0)
+        size = len(next(iter(dense.values())))
+        sample = rng.choice(size, min(queries, size), replace=False)
+        mask = np.ones(size, dtype=bool)
+        results = {}
+        for label, matrices in (("dense", dense), ("sparse", csr)):
+            engine = SimilarityEngine(matrices, precision="float32")
+
+            def score():
+                return [
+                    top_k_indices(engine.similarity_row(idx), 10, mask)
+                    for idx in sample
+                ]
+
+            results[label] = score()
+            ms = timeit.timeit(score, number=1) * 1000 / len(sample)
+            click.echo(f"{label}: {engine.nbytes / 2**20:8.1f} MiB  {ms:8.3f} ms/query")
+
+        overlap = np.mean(
+            [
+                len(np.intersect1d(d, s)) / 10
+                for d, s in zip(results["dense"], results["sparse"])
+            ]
+        )
+        click.echo(f"top-10 overlap: {overlap:.3f}")
+
+    app.cli.add_command(nlp_cli)
+    app.cli.add_command(tfidf_cli)
+    app.cli.add_command(catalog_cli)
+    app.cli.add_command(bench_cli)
@@ -4,10 +4,12 @@ from .auth import auth_bp
 from .movie import movie_bp
 from .serie import serie_bp
 from .nlp_recommendations import nlp_bp
+from .health import health_bp
 
 def register_blueprints(app):
     app.register_blueprint(user_bp, url_prefix='/api')
     app.register_blueprint(auth_bp, url_prefix='/api')
     app.register_blueprint(movie_bp, url_prefix='/api')
     app.register_blueprint(serie_bp, url_prefix='/api')
-    app.register_blueprint(nlp_bp, url_prefix='/api')
\ No newline at end of file
+    app.register_blueprint(nlp_bp, url_prefix='/api')
+    app.register_blueprint(health_bp)
\ No newline at end of file
@@ -0,0 +1,41 @@
+from flask import Blueprint, jsonify
+
+from .nlp_recommendations import nlp_model_holder
+
+health_bp = Blueprint("health_bp", __name__)
+
+
+@health_bp.route("/health/ready", methods=["GET"])
+def readiness():
+    """
+    Report whether the application is ready to serve every endpoint.
+
+    Route: /health/ready
+    Method: GET
+
+    Returns:
+        dict: A dictionary containing:
+            - status (str): "ready" if every component is ready, "warming up" otherwise.
+            - nlp_model (dict): The loading status of the NLP model, the
+              last loading error, if any, the version being served and
+              whether a new version is being loaded, and the size, hits,
+              misses and evictions of its candidate cache.
+
+    Status Codes:
+        200: The application is ready.
+        503: The NLP model is still loading or failed to load.
+    """
+    nlp_model = nlp_model_holder.get()  # Inicia o carregamento se ainda não começou
+
+    ready = nlp_model_holder.ready
+    body = {
+        "status": "ready" if ready else "warming up",
+        "nlp_model": {
+            "status": nlp_model_holder.status,
+            "error": nlp_model_holder.error,
+            "version": nlp_model_holder.version,
+            "reloading": nlp_model_holder.reloading,
+            "candidate_cache": nlp_model.candidate_cache.stats() if nlp_model else None,
+        },
+    }
+    return jsonify(body), 200 if ready else 503
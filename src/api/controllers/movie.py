@@ -1,14 +1,16 @@
 from flask import Blueprint, request, jsonify
 from flask_jwt_extended import jwt_required
-from sqlalchemy.exc import SQLAlchemyError
-from sqlalchemy import func, or_
-from sklearn.feature_extraction.text import TfidfVectorizer
-from sklearn.metrics.pairwise import cosine_similarity
+from sqlalchemy.exc import IntegrityError, SQLAlchemyError
+from sqlalchemy import func, literal, or_, select, union_all
 import numpy as np
 import pandas as pd
-import datetime
-from api.utils import APIException
-from api.models import Movie, MovieUserRating, User
+from api.utils import APIException, top_k_indices
+from api.seen_items import seen_items
+from api.ratings import save_ratings, MAX_BULK_RATINGS
+from api.taste_vectors import get_taste_vector
+from api.tfidf_store import movie_tfidf
+from api.models import Movie, MovieUserRating, MovieGenre, Genre, User
+from api.models.genre import genre_matches, genre_pattern
 from api import db
 
 movie_bp = Blueprint("movie_bp", __name__)
@@ -61,45 +63,23 @@ def get_first_movies_by_genre():
 
     user_age = user.age
 
-    # Define the minimum age required for each rating
-    age_restrictions = {
-        "TV-Y": 0,
-        "TV-Y7": 7,
-        "TV-Y7-FV": 7,
-        "TV-G": 0,
-        "TV-PG": 10,
-        "TV-14": 14,
-        "TV-MA": 17,
-        "G": 0,
-        "PG": 10,
-        "PG-13": 13,
-        "R": 17,
-        "NC-17": 18,
-        "NR": 18,
-        "UR": 18,
-        "": 18,
-    }
-
-    # Create the filter conditions
-    genre_filters = [Movie.genres.contains(genre) for genre in genres]
+    # Find the movies of the genres through the genre links
+    genre_movies = (
+        db.session.query(MovieGenre.movie_id)
+        .join(Genre, Genre.id == MovieGenre.genre_id)
+        .filter(or_(*[genre_matches(genre_pattern(genre)) for genre in genres]))
+    )
 
-    # Query the movies
+    # Query the most popular movies the user is old enough to watch
     movies = (
-        Movie.query.filter(or_(*genre_filters))
-        .filter(Movie.popularity != None)
+        Movie.query.filter(Movie.id.in_(genre_movies))
+        .filter(Movie.popularity != None, Movie.min_age <= user_age)
         .order_by(Movie.popularity.desc())
         .limit(90)
         .all()
     )
 
-    # Filter movies based on user's age
-    filtered_movies = []
-    for movie in movies:
-        movie_age_rating = age_restrictions.get(movie.age_rating, 18)
-        if movie_age_rating <= user_age:
-            filtered_movies.append(movie.serialize())
-
-    return jsonify(filtered_movies)
+    return jsonify([movie.serialize() for movie in movies])
 
 
 @movie_bp.route("/movies", methods=["POST"])
@@ -142,9 +122,6 @@ def get_movies_by_genre():
             "The 'genre' field must be a non-empty list", status_code=400
         )
 
-    all_movies = []
-    seen_movies = set()
-
     # Retrieve user info
     user = User.query.get(user_id)
     if not user:
@@ -152,52 +129,81 @@ def get_movies_by_genre():
 
     user_age = user.age
 
-    # Retrieve the movies rated by the user
-    rated_movies = MovieUserRating.query.filter_by(user_id=user_id).all()
-    rated_movie_ids = {rating.movie_id for rating in rated_movies}
-
-    # Define the minimum age required for each rating
-    age_restrictions = {
-        "TV-Y": 0,
-        "TV-Y7": 7,
-        "TV-Y7-FV": 7,
-        "TV-G": 0,
-        "TV-PG": 10,
-        "TV-14": 14,
-        "TV-MA": 17,
-        "G": 0,
-        "PG": 10,
-        "PG-13": 13,
-        "R": 17,
-        "NC-17": 18,
-        "NR": 18,
-        "UR": 18,
-        "": 18,
-    }
+    # Number of movies returned for each genre
+    limit = 30
+
+    # Rank the movies of every requested genre by popularity in a single query,
+    # reading the genre links in the order of their (genre, popularity) index and
+    # leaving out the ones the user rated or is too young to watch. The genre
+    # at `position` keeps limit x (position + 1) candidates, enough to still
+    # have its limit after removing the ones taken by the genres before it.
+    requested_genres = union_all(
+        *[
+            select(
+                literal(genre_pattern(genre)).label("pattern"),
+                literal(position).label("position"),
+            )
+            for position, genre in enumerate(genres)
+        ]
+    ).subquery()
+    rated = (
+        db.session.query(MovieUserRating.id)
+        .filter(
+            MovieUserRating.user_id == user_id,
+            MovieUserRating.movie_id == Movie.id,
+        )
+        .exists()
+    )
+    # A requested genre may match several genres of a movie, so each movie
+    # is kept once per requested genre before ranking
+    genre_movies = (
+        db.session.query(
+            MovieGenre.movie_id, MovieGenre.popularity, requested_genres.c.position
+        )
+        .join(Genre, Genre.id == MovieGenre.genre_id)
+        .join(requested_genres, genre_matches(requested_genres.c.pattern))
+        .join(Movie, Movie.id == MovieGenre.movie_id)
+        .filter(
+            MovieGenre.popularity != None,
+            Movie.min_age <= user_age,
+            ~rated,
+        )
+        .distinct()
+        .subquery()
+    )
+    genre_rank = (
+        func.row_number()
+        .over(
+            partition_by=genre_movies.c.position,
+            order_by=(genre_movies.c.popularity.desc(), genre_movies.c.movie_id),
+        )
+        .label("genre_rank")
+    )
+    ranked_movies = db.session.query(
+        genre_movies.c.movie_id, genre_movies.c.position, genre_rank
+    ).subquery()
 
     try:
-        for genre in genres:
-            genre_movies = (
-                Movie.query.filter(
-                    Movie.genres.contains(genre),
-                    Movie.popularity != None,
-                    ~Movie.id.in_(seen_movies),
-                    ~Movie.id.in_(rated_movie_ids),
-                )
-                .order_by(Movie.popularity.desc())
-                .limit(30)
-                .all()
+        candidates = (
+            db.session.query(Movie, ranked_movies.c.position)
+            .join(ranked_movies, Movie.id == ranked_movies.c.movie_id)
+            .filter(
+                ranked_movies.c.genre_rank
+                <= limit * (ranked_movies.c.position + 1)
             )
-            for movie in genre_movies:
-                movie_age_rating = age_restrictions.get(movie.age_rating, 18)
-                if movie_age_rating <= user_age and movie.id not in seen_movies:
-                    seen_movies.add(movie.id)
-                    all_movies.append({"genre": genre, "movie": movie})
+            .order_by(ranked_movies.c.position, ranked_movies.c.genre_rank)
+            .all()
+        )
 
-        # Organize movies by genre
+        # Organize movies by genre, without repeating movies across genres
         movies_by_genre = {genre: [] for genre in genres}
-        for item in all_movies:
-            movies_by_genre[item["genre"]].append(item["movie"].serialize())
+        taken = [0] * len(genres)
+        seen_movies = set()
+        for movie, position in candidates:
+            if taken[position] < limit and movie.id not in seen_movies:
+                taken[position] += 1
+                seen_movies.add(movie.id)
+                movies_by_genre[genres[position]].append(movie.serialize())
 
         return jsonify(movies_by_genre)
     except SQLAlchemyError as e:
@@ -281,57 +287,123 @@ def rate_movie():
     if rating is None:
         raise APIException("The 'rating' field is required", status_code=400)
 
+    if not isinstance(rating, str):
+        raise APIException("Invalid rating value", status_code=400)
+
+    # The taste vectors and the removed ratings are keyed by integer ids
+    if not isinstance(movie_id, int):
+        raise APIException("The 'movie_id' field must be an integer", status_code=400)
+
     try:
-        # Check if the movie exists
-        movie = Movie.query.get(movie_id)
-        if not movie:
-            raise APIException("Movie not found", status_code=404)
+        # Insert or update the rating in a single statement
+        removed = save_ratings(user_id, "movie", {movie_id: rating})
+    except IntegrityError:
+        db.session.rollback()
+        if not db.session.get(User, user_id):
+            raise APIException("User not found", status_code=404)
+        raise APIException("Movie not found", status_code=404)
+    except SQLAlchemyError as e:
+        db.session.rollback()
+        raise APIException("Database error: " + str(e), status_code=500)
 
-        # Check if the user exists
-        user = User.query.get(user_id)
-        if not user:
+    if rating == "":
+        if movie_id in removed:
+            return jsonify({"message": "Rating removed"}), 200
+        # Nothing was deleted, which is also the case of an unknown movie or user
+        if not db.session.get(Movie, movie_id):
+            raise APIException("Movie not found", status_code=404)
+        if not db.session.get(User, user_id):
             raise APIException("User not found", status_code=404)
+        return jsonify({"message": "No existing rating to remove"}), 200
+
+    return jsonify({"message": "Successfully rated the movie"}), 200
+
 
-        # Check if the user has already rated this movie
-        existing_rating = MovieUserRating.query.filter_by(
-            user_id=user_id, movie_id=movie_id
-        ).first()
-
-        if rating == "":
-            # If the rating is empty, remove the existing rating
-            if existing_rating:
-                db.session.delete(existing_rating)
-                db.session.commit()
-                return jsonify({"message": "Rating removed"}), 200
-            else:
-                return jsonify({"message": "No existing rating to remove"}), 200
-        else:
-            # Validate rating
-            if not isinstance(rating, str):
-                raise APIException("Invalid rating value", status_code=400)
-
-            if existing_rating:
-                # Update the existing rating
-                existing_rating.rating = rating
-                existing_rating.date_rated = datetime.datetime.now()
-            else:
-                # Add a new rating
-                new_rating = MovieUserRating(
-                    user_id=user_id,
-                    movie_id=movie_id,
-                    rating=rating,
-                    date_rated=datetime.datetime.now(),
-                )
-                db.session.add(new_rating)
-
-            db.session.commit()
-
-            return jsonify({"message": "Successfully rated the movie"}), 200
+@movie_bp.route("/rate-movies/bulk", methods=["POST"])
+def rate_movies_bulk():
+    """
+    Rate several movies at once, in one transaction.
+
+    Route: /rate-movies/bulk
+    Method: POST
+
+    JSON Parameters:
+        user_id (int): The ID of the user rating the movies. Required.
+        ratings (list): Objects with the "movie_id" and "rating" of each
+            movie, at most 500. An empty rating removes the
+            rating of the movie. Required.
 
+    Returns:
+        dict: A message and the number of ratings written and removed.
+
+    Status Codes:
+        200: Successfully rated the movies.
+        400: Missing or invalid parameters.
+        404: User or one of the movies not found.
+        500: Internal server error.
+    """
+    body = request.get_json()
+
+    if not body:
+        raise APIException("Missing JSON body", status_code=400)
+
+    user_id = body.get("user_id")
+    ratings = body.get("ratings")
+
+    if not user_id:
+        raise APIException("You need to specify the following fields: user_id")
+    if not isinstance(ratings, list) or not ratings:
+        raise APIException("The 'ratings' field must be a non-empty list")
+    if len(ratings) > MAX_BULK_RATINGS:
+        raise APIException(
+            f"At most {MAX_BULK_RATINGS} ratings can be sent at once", status_code=400
+        )
+
+    # The last rating of a movie wins if it is sent more than once
+    new_ratings = {}
+    for item in ratings:
+        if (
+            not isinstance(item, dict)
+            or not isinstance(item.get("movie_id"), int)
+            or not isinstance(item.get("rating"), str)
+        ):
+            raise APIException(
+                "Each rating needs an integer 'movie_id' and a string 'rating'",
+                status_code=400,
+            )
+        new_ratings[item["movie_id"]] = item["rating"]
+
+    # Removals do not fail on an unknown movie or user, so check them first
+    removed_ids = [movie_id for movie_id, rating in new_ratings.items() if not rating]
+    if removed_ids:
+        if not db.session.get(User, user_id):
+            raise APIException("User not found", status_code=404)
+        found = db.session.query(Movie.id).filter(Movie.id.in_(removed_ids)).count()
+        if found < len(removed_ids):
+            raise APIException("One or more movies not found", status_code=404)
+
+    try:
+        save_ratings(user_id, "movie", new_ratings)
+    except IntegrityError:
+        db.session.rollback()
+        if not db.session.get(User, user_id):
+            raise APIException("User not found", status_code=404)
+        raise APIException("One or more movies not found", status_code=404)
     except SQLAlchemyError as e:
         db.session.rollback()
         raise APIException("Database error: " + str(e), status_code=500)
 
+    return (
+        jsonify(
+            {
+                "message": "Successfully rated the movies",
+                "rated": len(new_ratings) - len(removed_ids),
+                "removed": len(removed_ids),
+            }
+        ),
+        200,
+    )
+
 
 @movie_bp.route("/user-ratings/<int:user_id>/movies", methods=["GET"])
 def get_user_movies_ratings(user_id):
@@ -435,122 +507,52 @@ def recommend_movies():
     user_favorite_genres = user.favorite_genres.split(", ")
 
     # Retrieve the movies rated by the user
-    rated_movies = MovieUserRating.query.filter_by(user_id=user_id).all()
-    rated_movie_ids = {rating.movie_id for rating in rated_movies}
+    rated_movie_ids = seen_items.seen_ids(user_id, "movie")
 
-    # Categorize user's ratings
-    user_loves = [
-        rating.movie_id for rating in rated_movies if rating.rating == "Me encanta"
-    ]
-    user_likes = [
-        rating.movie_id for rating in rated_movies if rating.rating == "Me gusta"
-    ]
-    user_dislikes = [
-        rating.movie_id for rating in rated_movies if rating.rating == "No me gusta"
-    ]
+    # Load the TF-IDF model of the movies, fitted once and shared by the requests
+    movies_tfidf = movie_tfidf.get()
 
-    # Fetch all movies from the database
-    movies = Movie.query.all()
-    movies_df = pd.DataFrame([movie.serialize() for movie in movies])
+    # Score the catalog against the taste vector of the user, the sum of the
+    # rated movies weighted as 2 x loves + likes - dislikes
+    taste_vector = get_taste_vector(user.id, "movie", movies_tfidf)
+    recommended_scores = movies_tfidf.scores(taste_vector)
 
-    # Combine the features for each movie
-    def combine_features(row):
-        return " ".join(
-            str(row[col]).lower() for col in ["title", "director", "cast", "genres"]
-        )
+    # Filter by age restrictions and rated movies with masks over the rows
+    # of the model
+    eligible_movies = movies_tfidf.allowed_mask(user_age, rated_movie_ids)
 
-    movies_df["combined_features"] = movies_df.apply(combine_features, axis=1)
-
-    # Initialize the TF-IDF Vectorizer
-    tfidf_vectorizer = TfidfVectorizer(stop_words="english")
-
-    # Fit and transform the combined features
-    tfidf_matrix = tfidf_vectorizer.fit_transform(movies_df["combined_features"])
-
-    # Calculate the cosine similarity matrix
-    cosine_sim = cosine_similarity(tfidf_matrix, tfidf_matrix)
-
-    # Define the minimum age required for each rating
-    age_restrictions = {
-        "TV-Y": 0,
-        "TV-Y7": 7,
-        "TV-Y7-FV": 7,
-        "TV-G": 0,
-        "TV-PG": 10,
-        "TV-14": 14,
-        "TV-MA": 17,
-        "G": 0,
-        "PG": 10,
-        "PG-13": 13,
-        "R": 17,
-        "NC-17": 18,
-        "NR": 18,
-        "UR": 18,
-        "": 18,
-    }
+    # Organize movies by genre, keeping only the top 30 of each genre and no duplicates
+    top_movies_by_genre = {genre: [] for genre in user_favorite_genres}
+    seen_movies = np.zeros(len(movies_tfidf), dtype=bool)
 
-    # Function to get recommendations
-    def get_recommendations(
-        user_loves, user_likes, user_dislikes, cosine_sim=cosine_sim
-    ):
-        loved_movie_indices = movies_df[movies_df["id"].isin(user_loves)].index.tolist()
-        liked_movie_indices = movies_df[movies_df["id"].isin(user_likes)].index.tolist()
-        disliked_movie_indices = movies_df[
-            movies_df["id"].isin(user_dislikes)
-        ].index.tolist()
-
-        sim_scores_loves = np.sum(cosine_sim[loved_movie_indices], axis=0)
-        sim_scores_likes = np.sum(cosine_sim[liked_movie_indices], axis=0)
-        sim_scores_dislikes = np.sum(cosine_sim[disliked_movie_indices], axis=0)
-
-        combined_sim_scores = (
-            sim_scores_loves * 2 + sim_scores_likes - sim_scores_dislikes
+    for genre in user_favorite_genres:
+        in_genre = movies_tfidf.genre_mask(genre)
+        top_movies = top_k_indices(
+            recommended_scores, 30, eligible_movies & in_genre & ~seen_movies
         )
-
-        sim_scores = list(enumerate(combined_sim_scores))
-        sim_scores = sorted(sim_scores, key=lambda x: x[1], reverse=True)
-
-        all_liked_indices = set(
-            loved_movie_indices + liked_movie_indices + disliked_movie_indices
+        seen_movies[top_movies] = True
+        top_movies_by_genre[genre] = movies_tfidf.ids[top_movies].tolist()
+
+    # Retrieve the details of the recommended movies with a single query,
+    # checking the age limit again against the database, as the model may
+    # predate a change of age rating
+    recommended_ids = [
+        movie_id for ids in top_movies_by_genre.values() for movie_id in ids
+    ]
+    recommended_movies = {
+        movie.id: movie.serialize()
+        for movie in Movie.query.filter(
+            Movie.id.in_(recommended_ids), Movie.min_age <= user_age
         )
-        sim_scores = [
-            score for score in sim_scores if score[0] not in all_liked_indices
+    }
+    movies_by_genre = {
+        genre: [
+            recommended_movies[movie_id]
+            for movie_id in ids
+            if movie_id in recommended_movies
         ]
-
-        movie_indices = [i[0] for i in sim_scores]
-
-        return movies_df.iloc[movie_indices]
-
-    recommended_movies = get_recommendations(user_loves, user_likes, user_dislikes)
-
-    # Filter by age restrictions and genres
-    def filter_movies(movie):
-        movie_age_rating = age_restrictions.get(movie["age_rating"], 18)
-        if movie_age_rating > user_age or movie["id"] in rated_movie_ids:
-            return False
-        for genre in user_favorite_genres:
-            if genre.lower() in movie["genres"].lower():
-                return True
-        return False
-
-    filtered_movies = recommended_movies[
-        recommended_movies.apply(filter_movies, axis=1)
-    ]
-
-    # Organize movies by genre, ensuring no duplicates
-    movies_by_genre = {genre: [] for genre in user_favorite_genres}
-    seen_movies = set()
-
-    for _, movie in filtered_movies.iterrows():
-        for genre in user_favorite_genres:
-            if (
-                genre.lower() in movie["genres"].lower()
-                and movie["id"] not in seen_movies
-            ):
-                movies_by_genre[genre].append(movie.to_dict())
-                seen_movies.add(movie["id"])
-                if len(movies_by_genre[genre]) == 30:
-                    break
+        for genre, ids in top_movies_by_genre.items()
+    }
 
     return jsonify(movies_by_genre)
 
@@ -1,10 +1,18 @@
 from flask import Blueprint, request, jsonify
 
-import pandas as pd
-import numpy as np
 import os
-from sklearn.metrics.pairwise import cosine_similarity
 from api.models import Movie, Serie, User
+from api.nlp import (
+    load_model,
+    ModelHolder,
+    COMPONENTS,
+    DEFAULT_WEIGHTS,
+    DEFAULT_PRECISION,
+    DEFAULT_CACHE_SIZE,
+    version_dir,
+    current_version,
+)
+from api.seen_items import seen_items, recent_ratings, RATING_WEIGHTS
 
 nlp_bp = Blueprint("nlp_bp", __name__)
 
@@ -12,77 +20,99 @@ nlp_bp = Blueprint("nlp_bp", __name__)
 directorio_proyecto = os.path.dirname(os.path.abspath(__file__))
 nlp_resources_dir = os.path.join(directorio_proyecto, "nlp_resources")
 
-df_netflix_bd = pd.read_csv(os.path.join(nlp_resources_dir, "df_netflix_bd.csv"))
-description_process = np.load(
-    os.path.join(nlp_resources_dir, "description_process.npy")
-)
-genres_process = np.load(os.path.join(nlp_resources_dir, "genres_process.npy"))
-director_process = np.load(os.path.join(nlp_resources_dir, "director_process.npy"))
 
-cosine_sim_description = cosine_similarity(description_process, description_process)
-cosine_sim_genres = cosine_similarity(genres_process, genres_process)
-cosine_sim_director = cosine_similarity(director_process, director_process)
+# Artefatos compilados (flask nlp export) são abertos com memory mapping e
+# compartilhados entre os workers do gunicorn. O modelo é carregado em uma
+# thread em segundo plano (ou no primeiro uso com NLP_WARMUP=lazy) para não
+# atrasar o início da aplicação. NLP_ANN_BACKEND=ivf ativa a busca aproximada
+# e NLP_PRECISION escolhe a precisão dos embeddings (float32, float64 ou int8).
+# NLP_CANDIDATE_CACHE_SIZE limita o número de sementes no cache de candidatos
+def load_nlp_model(version=None):
+    return load_model(
+        version_dir(nlp_resources_dir, version),
+        ann_backend=os.getenv("NLP_ANN_BACKEND"),
+        precision=os.getenv("NLP_PRECISION", DEFAULT_PRECISION),
+        cache_size=int(os.getenv("NLP_CANDIDATE_CACHE_SIZE", DEFAULT_CACHE_SIZE)),
+    )
+
 
-combined_embedding = (
-    0.5 * cosine_sim_description + 0.3 * cosine_sim_director + 0.2 * cosine_sim_genres
+# A versão publicada (flask nlp publish) é verificada a cada
+# NLP_RELOAD_INTERVAL segundos; uma versão nova é carregada em segundo plano
+# e substitui o modelo atual sem reiniciar os workers
+nlp_model_holder = ModelHolder(
+    load_nlp_model,
+    version=lambda: current_version(nlp_resources_dir),
+    poll_interval=float(os.getenv("NLP_RELOAD_INTERVAL", 30)),
 )
+if os.getenv("NLP_WARMUP", "background") != "lazy":
+    nlp_model_holder.start()
 
-titles = df_netflix_bd["id"]
-indices = pd.Series(df_netflix_bd.index, index=df_netflix_bd["id"])
+# Número máximo de sementes aceitas por chamada em lote
+MAX_BATCH_SEEDS = 50
 
+# Avaliações recentes usadas como sementes das recomendações de sessão
+DEFAULT_SESSION_RATINGS = 20
+MAX_SESSION_RATINGS = 200
 
-def get_recommendations(title, item_type, user_age, seen_ids, top_n=10):
-    idx = indices[title]
-    sim_scores = list(enumerate(combined_embedding[idx]))
-    sim_scores = sorted(sim_scores, key=lambda x: x[1], reverse=True)
-    sim_scores = sim_scores[1:]  # Ignorar o primeiro, pois é o mesmo filme/série
 
-    # Filtrar por tipo
-    if item_type == "movie":
-        filtered_scores = [
-            score
-            for score in sim_scores
-            if df_netflix_bd.iloc[score[0]]["type"] == "movie"
-        ]
-    elif item_type == "tv-show":
-        filtered_scores = [
-            score
-            for score in sim_scores
-            if df_netflix_bd.iloc[score[0]]["type"] == "tv-show"
-        ]
-    else:
-        filtered_scores = []
-
-    # Filtrar por idade
-    if user_age < 6:
-        age_filters = ["all audiences"]
-    elif 6 <= user_age < 12:
-        age_filters = ["children", "all audiences"]
-    elif 12 <= user_age < 15:
-        age_filters = ["youngs", "children", "all audiences"]
-    elif 15 <= user_age < 18:
-        age_filters = ["teenagers", "youngs", "children", "all audiences"]
-    else:
-        age_filters = ["adults", "teenagers", "youngs", "children", "all audiences"]
-
-    filtered_scores = [
-        score
-        for score in filtered_scores
-        if df_netflix_bd.iloc[score[0]]["public"] in age_filters
-    ]
-    filtered_scores = [
-        score
-        for score in filtered_scores
-        if df_netflix_bd.iloc[score[0]]["id"] not in seen_ids
-    ]
-    filtered_scores = filtered_scores[:top_n]
+def get_popular_recommendations(model, user_age, seen_ids, top_n=10):
+    # Recomendações por popularidade enquanto o modelo NLP não está pronto
+    query = model.query.filter(model.popularity != None, model.min_age <= user_age)
+    if seen_ids:
+        query = query.filter(~model.id.in_(seen_ids))
+    return query.order_by(model.popularity.desc()).limit(top_n).all()
+
+
+def parse_weights(weights):
+    """
+    Validate the per-component similarity weights of a request.
+
+    Components missing from `weights` keep their default weight.
+
+    Returns:
+        tuple: The weights to use (None for the defaults) and an error
+            message, or None if they are valid.
+    """
+    if weights is None:
+        return None, None
+    if not isinstance(weights, dict) or not set(weights) <= set(COMPONENTS):
+        return None, f"weights must map some of {', '.join(COMPONENTS)} to numbers"
+    if not all(
+        isinstance(weight, (int, float)) and not isinstance(weight, bool)
+        for weight in weights.values()
+    ):
+        return None, "weights must be numbers"
 
-    movie_indices = [i[0] for i in filtered_scores]
-    return titles.iloc[movie_indices].tolist()
+    weights = {**DEFAULT_WEIGHTS, **{name: float(w) for name, w in weights.items()}}
+    if any(weight < 0 for weight in weights.values()) or not any(weights.values()):
+        return None, "weights must be non-negative and not all zero"
+    return weights, None
 
 
 @nlp_bp.route("/nlp-recommendations", methods=["POST"])
 def nlp_recommendations():
+    """
+    Get titles similar to a movie or serie.
+
+    Route: /nlp-recommendations
+    Method: POST
+
+    JSON Parameters:
+        item_id (int): Id of the seed movie or serie. Required.
+        item_type (str): "movie" or "serie". Required.
+        user_id (int): The ID of the user. Required.
+        weights (dict): Weight of the "description", "director" and "genres"
+            similarities. Optional; missing components keep their default
+            weight (0.5, 0.3 and 0.2).
+
+    Returns:
+        list: A list of dictionaries containing the details of the recommended titles.
+
+    Status Codes:
+        200: Successfully retrieved the recommendations.
+        400: Missing or invalid parameters.
+        404: User not found.
+    """
     data = request.get_json()
 
     item_id = data.get("item_id")
@@ -101,6 +131,10 @@ def nlp_recommendations():
     if item_type not in ["movie", "serie"]:
         return jsonify({"error": "Invalid type parameter"}), 400
 
+    weights, error = parse_weights(data.get("weights"))
+    if error:
+        return jsonify({"error": error}), 400
+
     # Recuperar idade do usuário
     user = User.query.get(user_id)
     if not user:
@@ -108,24 +142,264 @@ def nlp_recommendations():
 
     user_age = user.age
 
-    # Recuperar filmes e séries já avaliados pelo usuário
-    seen_movie_ids = {rating.movie_id for rating in user.movies_ratings}
-    seen_serie_ids = {rating.serie_id for rating in user.series_ratings}
+    # Recuperar apenas os ids já avaliados do tipo pedido
+    seen_ids = seen_items.seen_ids(user_id, item_type)
+
+    item_model = Movie if item_type == "movie" else Serie
 
-    seen_ids = seen_movie_ids if item_type == "movie" else seen_serie_ids
+    # Enquanto o modelo aquece, responder com os títulos mais populares
+    nlp_model = nlp_model_holder.get()
+    if nlp_model is None:
+        recommendations = get_popular_recommendations(item_model, user_age, seen_ids)
+        recommendations_data = [rec.serialize() for rec in recommendations]
+        return (
+            jsonify(recommendations_data),
+            200,
+            {"X-Recommendations-Source": "popularity"},
+        )
 
     # Mapear 'serie' para 'tv-show' no dataframe
     df_item_type = "movie" if item_type == "movie" else "tv-show"
 
     # Buscar recomendações
-    recommendations_ids = get_recommendations(item_id, df_item_type, user_age, seen_ids)
+    recommendations_ids = nlp_model.recommend(
+        item_id, df_item_type, user_age, seen_ids, weights=weights
+    )
 
     # Recuperar dados do banco de dados
-    if item_type == "movie":
-        recommendations = Movie.query.filter(Movie.id.in_(recommendations_ids)).all()
-    else:
-        recommendations = Serie.query.filter(Serie.id.in_(recommendations_ids)).all()
+    recommendations = item_model.query.filter(
+        item_model.id.in_(recommendations_ids)
+    ).all()
 
     recommendations_data = [rec.serialize() for rec in recommendations]
 
-    return jsonify(recommendations_data), 200
+    return jsonify(recommendations_data), 200, {"X-Recommendations-Source": "nlp"}
+
+
+@nlp_bp.route("/nlp-recommendations/batch", methods=["POST"])
+def nlp_recommendations_batch():
+    """
+    Get NLP recommendations for several seed titles in one call.
+
+    Route: /nlp-recommendations/batch
+    Method: POST
+
+    JSON Parameters:
+        item_ids (list): Ids of the seed movies or series. Required.
+        item_type (str): "movie" or "serie". Required.
+        user_id (int): The ID of the user. Required.
+        weights (dict): Weight of the "description", "director" and "genres"
+            similarities. Optional.
+
+    Returns:
+        list: One dictionary per seed, in the requested order, containing:
+            - item_id (int): The id of the seed.
+            - recommendations (list): The recommended titles, from most to
+              least similar.
+
+    Status Codes:
+        200: Successfully retrieved the recommendations.
+        400: Missing or invalid parameters.
+        404: User not found.
+    """
+    data = request.get_json()
+
+    item_ids = data.get("item_ids")
+    item_type = data.get("item_type")
+    user_id = data.get("user_id")
+
+    if not item_ids or not item_type or user_id is None:
+        return jsonify({"error": "Missing required parameters"}), 400
+
+    if not isinstance(item_ids, list) or len(item_ids) > MAX_BATCH_SEEDS:
+        return (
+            jsonify(
+                {"error": f"item_ids must be a list of at most {MAX_BATCH_SEEDS} ids"}
+            ),
+            400,
+        )
+
+    try:
+        item_ids = [int(item_id) for item_id in item_ids]
+        user_id = int(user_id)
+    except (TypeError, ValueError):
+        return jsonify({"error": "Invalid item_ids or user_id parameter"}), 400
+
+    if item_type not in ["movie", "serie"]:
+        return jsonify({"error": "Invalid type parameter"}), 400
+
+    weights, error = parse_weights(data.get("weights"))
+    if error:
+        return jsonify({"error": error}), 400
+
+    user = User.query.get(user_id)
+    if not user:
+        return jsonify({"error": "User not found"}), 404
+
+    # Carregar uma única vez apenas os ids avaliados do tipo pedido
+    item_model = Movie if item_type == "movie" else Serie
+    seen_ids = seen_items.seen_ids(user_id, item_type)
+
+    nlp_model = nlp_model_holder.get()
+    if nlp_model is None:
+        popular = [
+            rec.serialize()
+            for rec in get_popular_recommendations(item_model, user.age, seen_ids)
+        ]
+        results = [
+            {"item_id": item_id, "recommendations": popular} for item_id in item_ids
+        ]
+        return jsonify(results), 200, {"X-Recommendations-Source": "popularity"}
+
+    df_item_type = "movie" if item_type == "movie" else "tv-show"
+    recommendations_ids = nlp_model.recommend_many(
+        item_ids, df_item_type, user.age, seen_ids, weights=weights
+    )
+
+    # Recuperar todos os títulos recomendados com uma única consulta
+    all_ids = {item_id for ids in recommendations_ids for item_id in ids}
+    items = {}
+    if all_ids:
+        items = {
+            item.id: item.serialize()
+            for item in item_model.query.filter(item_model.id.in_(all_ids))
+        }
+
+    results = [
+        {
+            "item_id": item_id,
+            "recommendations": [items[rec_id] for rec_id in ids if rec_id in items],
+        }
+        for item_id, ids in zip(item_ids, recommendations_ids)
+    ]
+    return jsonify(results), 200, {"X-Recommendations-Source": "nlp"}
+
+
+@nlp_bp.route("/nlp-recommendations/session", methods=["POST"])
+def nlp_recommendations_session():
+    """
+    Get titles similar to the ones a user rated recently.
+
+    The recent ratings of the user are combined into one weighted seed set
+    ("Me encanta" counts twice as much as "Me gusta", and titles similar to
+    the ones rated "No me gusta" are pushed down) and the catalog is scored
+    once against it.
+
+    Route: /nlp-recommendations/session
+    Method: POST
+
+    JSON Parameters:
+        user_id (int): The ID of the user. Required.
+        item_type (str): "movie" or "serie". Required.
+        limit (int): Number of recent ratings used as seeds. Optional;
+            default is 20, at most 200.
+        weights (dict): Weight of the "description", "director" and "genres"
+            similarities. Optional.
+
+    Returns:
+        list: A list of dictionaries containing the details of the recommended
+            titles, from best to worst match. The most popular titles are
+            returned if the user has not liked any title of the type yet.
+
+    Status Codes:
+        200: Successfully retrieved the recommendations.
+        400: Missing or invalid parameters.
+        404: User not found.
+    """
+    data = request.get_json()
+
+    item_type = data.get("item_type")
+    user_id = data.get("user_id")
+    limit = data.get("limit", DEFAULT_SESSION_RATINGS)
+
+    if not item_type or user_id is None:
+        return jsonify({"error": "Missing required parameters"}), 400
+
+    try:
+        user_id = int(user_id)
+        limit = int(limit)
+    except (TypeError, ValueError):
+        return jsonify({"error": "Invalid user_id or limit parameter"}), 400
+
+    if not 0 < limit <= MAX_SESSION_RATINGS:
+        return (
+            jsonify({"error": f"limit must be between 1 and {MAX_SESSION_RATINGS}"}),
+            400,
+        )
+
+    if item_type not in ["movie", "serie"]:
+        return jsonify({"error": "Invalid type parameter"}), 400
+
+    weights, error = parse_weights(data.get("weights"))
+    if error:
+        return jsonify({"error": error}), 400
+
+    user = User.query.get(user_id)
+    if not user:
+        return jsonify({"error": "User not found"}), 404
+
+    item_model = Movie if item_type == "movie" else Serie
+    seen_ids = seen_items.seen_ids(user_id, item_type)
+
+    # Sementes ponderadas a partir das avaliações mais recentes
+    seeds = {}
+    for item_id, rating in recent_ratings(user_id, item_type, limit):
+        seeds[item_id] = RATING_WEIGHTS.get(rating, 0)
+
+    nlp_model = nlp_model_holder.get()
+    recommendations_ids = []
+    if nlp_model is not None:
+        df_item_type = "movie" if item_type == "movie" else "tv-show"
+        recommendations_ids = nlp_model.recommend_profile(
+            seeds, df_item_type, user.age, seen_ids, weights=weights
+        )
+
+    if not recommendations_ids:
+        recommendations = get_popular_recommendations(item_model, user.age, seen_ids)
+        recommendations_data = [rec.serialize() for rec in recommendations]
+        return (
+            jsonify(recommendations_data),
+            200,
+            {"X-Recommendations-Source": "popularity"},
+        )
+
+    # Manter a ordem do ranking
+    items = {
+        item.id: item.serialize()
+        for item in item_model.query.filter(item_model.id.in_(recommendations_ids))
+    }
+    recommendations_data = [
+        items[item_id] for item_id in recommendations_ids if item_id in items
+    ]
+    return jsonify(recommendations_data), 200, {"X-Recommendations-Source": "nlp"}
+
+
+@nlp_bp.route("/nlp-recommendations/reload", methods=["POST"])
+def nlp_reload():
+    """
+    Load the published version of the NLP artifacts in this worker.
+
+    The new model is loaded in the background and replaces the current one
+    once it is ready; requests keep being served by the current model until
+    then. The other workers pick up the new version on their next check of
+    the published version (every NLP_RELOAD_INTERVAL seconds).
+
+    Route: /nlp-recommendations/reload
+    Method: POST
+
+    Returns:
+        dict: A dictionary containing:
+            - reloading (bool): Whether a new load was started.
+            - published_version (str): The published version, if any.
+            - serving_version (str): The version currently served, if any.
+
+    Status Codes:
+        202: The reload was started, or there is nothing to reload.
+    """
+    reloading = nlp_model_holder.reload()
+    body = {
+        "reloading": reloading or nlp_model_holder.reloading,
+        "published_version": current_version(nlp_resources_dir),
+        "serving_version": nlp_model_holder.version,
+    }
+    return jsonify(body), 202
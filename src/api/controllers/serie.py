@@ -1,14 +1,16 @@
 from flask import Blueprint, request, jsonify
 from flask_jwt_extended import jwt_required
-from sqlalchemy.exc import SQLAlchemyError
-from sqlalchemy import func, or_
-from sklearn.feature_extraction.text import TfidfVectorizer
-from sklearn.metrics.pairwise import cosine_similarity
+from sqlalchemy.exc import IntegrityError, SQLAlchemyError
+from sqlalchemy import func, literal, or_, select, union_all
 import numpy as np
 import pandas as pd
-import datetime
-from api.utils import APIException
-from api.models import Serie, SerieUserRating, User
+from api.utils import APIException, top_k_indices
+from api.seen_items import seen_items
+from api.ratings import save_ratings, MAX_BULK_RATINGS
+from api.taste_vectors import get_taste_vector
+from api.tfidf_store import serie_tfidf
+from api.models import Serie, SerieUserRating, SerieGenre, Genre, User
+from api.models.genre import genre_matches, genre_pattern
 from api import db
 
 serie_bp = Blueprint("serie_bp", __name__)
@@ -61,45 +63,23 @@ def get_first_series_by_genre():
 
     user_age = user.age
 
-    # Define the minimum age required for each rating
-    age_restrictions = {
-        "TV-Y": 0,
-        "TV-Y7": 7,
-        "TV-Y7-FV": 7,
-        "TV-G": 0,
-        "TV-PG": 10,
-        "TV-14": 14,
-        "TV-MA": 17,
-        "G": 0,
-        "PG": 10,
-        "PG-13": 13,
-        "R": 17,
-        "NC-17": 18,
-        "NR": 18,
-        "UR": 18,
-        "": 18,
-    }
-
-    # Create the filter conditions
-    genre_filters = [Serie.genres.contains(genre) for genre in genres]
+    # Find the series of the genres through the genre links
+    genre_series = (
+        db.session.query(SerieGenre.serie_id)
+        .join(Genre, Genre.id == SerieGenre.genre_id)
+        .filter(or_(*[genre_matches(genre_pattern(genre)) for genre in genres]))
+    )
 
-    # Query the series
+    # Query the most popular series the user is old enough to watch
     series = (
-        Serie.query.filter(or_(*genre_filters))
-        .filter(Serie.popularity != None)
+        Serie.query.filter(Serie.id.in_(genre_series))
+        .filter(Serie.popularity != None, Serie.min_age <= user_age)
         .order_by(Serie.popularity.desc())
         .limit(90)
         .all()
     )
 
-    # Filter series based on user's age
-    filtered_series = []
-    for serie in series:
-        serie_age_rating = age_restrictions.get(serie.age_rating, 18)
-        if serie_age_rating <= user_age:
-            filtered_series.append(serie.serialize())
-
-    return jsonify(filtered_series)
+    return jsonify([serie.serialize() for serie in series])
 
 
 @serie_bp.route("/series", methods=["POST"])
@@ -142,9 +122,6 @@ def get_series_by_genre():
             "The 'genre' field must be a non-empty list", status_code=400
         )
 
-    all_series = []
-    seen_series = set()
-
     # Retrieve user info
     user = User.query.get(user_id)
     if not user:
@@ -152,52 +129,81 @@ def get_series_by_genre():
 
     user_age = user.age
 
-    # Retrieve the series rated by the user
-    rated_series = SerieUserRating.query.filter_by(user_id=user_id).all()
-    rated_serie_ids = {rating.serie_id for rating in rated_series}
-
-    # Define the minimum age required for each rating
-    age_restrictions = {
-        "TV-Y": 0,
-        "TV-Y7": 7,
-        "TV-Y7-FV": 7,
-        "TV-G": 0,
-        "TV-PG": 10,
-        "TV-14": 14,
-        "TV-MA": 17,
-        "G": 0,
-        "PG": 10,
-        "PG-13": 13,
-        "R": 17,
-        "NC-17": 18,
-        "NR": 18,
-        "UR": 18,
-        "": 18,
-    }
+    # Number of series returned for each genre
+    limit = 30
+
+    # Rank the series of every requested genre by popularity in a single query,
+    # reading the genre links in the order of their (genre, popularity) index and
+    # leaving out the ones the user rated or is too young to watch. The genre
+    # at `position` keeps limit x (position + 1) candidates, enough to still
+    # have its limit after removing the ones taken by the genres before it.
+    requested_genres = union_all(
+        *[
+            select(
+                literal(genre_pattern(genre)).label("pattern"),
+                literal(position).label("position"),
+            )
+            for position, genre in enumerate(genres)
+        ]
+    ).subquery()
+    rated = (
+        db.session.query(SerieUserRating.id)
+        .filter(
+            SerieUserRating.user_id == user_id,
+            SerieUserRating.serie_id == Serie.id,
+        )
+        .exists()
+    )
+    # A requested genre may match several genres of a serie, so each serie
+    # is kept once per requested genre before ranking
+    genre_series = (
+        db.session.query(
+            SerieGenre.serie_id, SerieGenre.popularity, requested_genres.c.position
+        )
+        .join(Genre, Genre.id == SerieGenre.genre_id)
+        .join(requested_genres, genre_matches(requested_genres.c.pattern))
+        .join(Serie, Serie.id == SerieGenre.serie_id)
+        .filter(
+            SerieGenre.popularity != None,
+            Serie.min_age <= user_age,
+            ~rated,
+        )
+        .distinct()
+        .subquery()
+    )
+    genre_rank = (
+        func.row_number()
+        .over(
+            partition_by=genre_series.c.position,
+            order_by=(genre_series.c.popularity.desc(), genre_series.c.serie_id),
+        )
+        .label("genre_rank")
+    )
+    ranked_series = db.session.query(
+        genre_series.c.serie_id, genre_series.c.position, genre_rank
+    ).subquery()
 
     try:
-        for genre in genres:
-            genre_series = (
-                Serie.query.filter(
-                    Serie.genres.contains(genre),
-                    Serie.popularity != None,
-                    ~Serie.id.in_(seen_series),
-                    ~Serie.id.in_(rated_serie_ids),
-                )
-                .order_by(Serie.popularity.desc())
-                .limit(30)
-                .all()
+        candidates = (
+            db.session.query(Serie, ranked_series.c.position)
+            .join(ranked_series, Serie.id == ranked_series.c.serie_id)
+            .filter(
+                ranked_series.c.genre_rank
+                <= limit * (ranked_series.c.position + 1)
             )
-            for serie in genre_series:
-                serie_age_rating = age_restrictions.get(serie.age_rating, 18)
-                if serie_age_rating <= user_age and serie.id not in seen_series:
-                    seen_series.add(serie.id)
-                    all_series.append({"genre": genre, "serie": serie})
+            .order_by(ranked_series.c.position, ranked_series.c.genre_rank)
+            .all()
+        )
 
-        # Organize series by genre
+        # Organize series by genre, without repeating series across genres
         series_by_genre = {genre: [] for genre in genres}
-        for item in all_series:
-            series_by_genre[item["genre"]].append(item["serie"].serialize())
+        taken = [0] * len(genres)
+        seen_series = set()
+        for serie, position in candidates:
+            if taken[position] < limit and serie.id not in seen_series:
+                taken[position] += 1
+                seen_series.add(serie.id)
+                series_by_genre[genres[position]].append(serie.serialize())
 
         return jsonify(series_by_genre)
     except SQLAlchemyError as e:
@@ -281,57 +287,123 @@ def rate_serie():
     if rating is None:
         raise APIException("The 'rating' field is required", status_code=400)
 
+    if not isinstance(rating, str):
+        raise APIException("Invalid rating value", status_code=400)
+
+    # The taste vectors and the removed ratings are keyed by integer ids
+    if not isinstance(serie_id, int):
+        raise APIException("The 'serie_id' field must be an integer", status_code=400)
+
     try:
-        # Check if the serie exists
-        serie = Serie.query.get(serie_id)
-        if not serie:
-            raise APIException("Serie not found", status_code=404)
+        # Insert or update the rating in a single statement
+        removed = save_ratings(user_id, "serie", {serie_id: rating})
+    except IntegrityError:
+        db.session.rollback()
+        if not db.session.get(User, user_id):
+            raise APIException("User not found", status_code=404)
+        raise APIException("Serie not found", status_code=404)
+    except SQLAlchemyError as e:
+        db.session.rollback()
+        raise APIException("Database error: " + str(e), status_code=500)
 
-        # Check if the user exists
-        user = User.query.get(user_id)
-        if not user:
+    if rating == "":
+        if serie_id in removed:
+            return jsonify({"message": "Rating removed"}), 200
+        # Nothing was deleted, which is also the case of an unknown serie or user
+        if not db.session.get(Serie, serie_id):
+            raise APIException("Serie not found", status_code=404)
+        if not db.session.get(User, user_id):
             raise APIException("User not found", status_code=404)
+        return jsonify({"message": "No existing rating to remove"}), 200
+
+    return jsonify({"message": "Successfully rated the serie"}), 200
+
 
-        # Check if the user has already rated this serie
-        existing_rating = SerieUserRating.query.filter_by(
-            user_id=user_id, serie_id=serie_id
-        ).first()
-
-        if rating == "":
-            # If the rating is empty, remove the existing rating
-            if existing_rating:
-                db.session.delete(existing_rating)
-                db.session.commit()
-                return jsonify({"message": "Rating removed"}), 200
-            else:
-                return jsonify({"message": "No existing rating to remove"}), 200
-        else:
-            # Validate rating
-            if not isinstance(rating, str):
-                raise APIException("Invalid rating value", status_code=400)
-
-            if existing_rating:
-                # Update the existing rating
-                existing_rating.rating = rating
-                existing_rating.date_rated = datetime.datetime.now()
-            else:
-                # Add a new rating
-                new_rating = SerieUserRating(
-                    user_id=user_id,
-                    serie_id=serie_id,
-                    rating=rating,
-                    date_rated=datetime.datetime.now(),
-                )
-                db.session.add(new_rating)
-
-            db.session.commit()
-
-            return jsonify({"message": "Successfully rated the serie"}), 200
+@serie_bp.route("/rate-series/bulk", methods=["POST"])
+def rate_series_bulk():
+    """
+    Rate several series at once, in one transaction.
+
+    Route: /rate-series/bulk
+    Method: POST
+
+    JSON Parameters:
+        user_id (int): The ID of the user rating the series. Required.
+        ratings (list): Objects with the "serie_id" and "rating" of each
+            serie, at most 500. An empty rating removes the
+            rating of the serie. Required.
 
+    Returns:
+        dict: A message and the number of ratings written and removed.
+
+    Status Codes:
+        200: Successfully rated the series.
+        400: Missing or invalid parameters.
+        404: User or one of the series not found.
+        500: Internal server error.
+    """
+    body = request.get_json()
+
+    if not body:
+        raise APIException("Missing JSON body", status_code=400)
+
+    user_id = body.get("user_id")
+    ratings = body.get("ratings")
+
+    if not user_id:
+        raise APIException("You need to specify the following fields: user_id")
+    if not isinstance(ratings, list) or not ratings:
+        raise APIException("The 'ratings' field must be a non-empty list")
+    if len(ratings) > MAX_BULK_RATINGS:
+        raise APIException(
+            f"At most {MAX_BULK_RATINGS} ratings can be sent at once", status_code=400
+        )
+
+    # The last rating of a serie wins if it is sent more than once
+    new_ratings = {}
+    for item in ratings:
+        if (
+            not isinstance(item, dict)
+            or not isinstance(item.get("serie_id"), int)
+            or not isinstance(item.get("rating"), str)
+        ):
+            raise APIException(
+                "Each rating needs an integer 'serie_id' and a string 'rating'",
+                status_code=400,
+            )
+        new_ratings[item["serie_id"]] = item["rating"]
+
+    # Removals do not fail on an unknown serie or user, so check them first
+    removed_ids = [serie_id for serie_id, rating in new_ratings.items() if not rating]
+    if removed_ids:
+        if not db.session.get(User, user_id):
+            raise APIException("User not found", status_code=404)
+        found = db.session.query(Serie.id).filter(Serie.id.in_(removed_ids)).count()
+        if found < len(removed_ids):
+            raise APIException("One or more series not found", status_code=404)
+
+    try:
+        save_ratings(user_id, "serie", new_ratings)
+    except IntegrityError:
+        db.session.rollback()
+        if not db.session.get(User, user_id):
+            raise APIException("User not found", status_code=404)
+        raise APIException("One or more series not found", status_code=404)
     except SQLAlchemyError as e:
         db.session.rollback()
         raise APIException("Database error: " + str(e), status_code=500)
 
+    return (
+        jsonify(
+            {
+                "message": "Successfully rated the series",
+                "rated": len(new_ratings) - len(removed_ids),
+                "removed": len(removed_ids),
+            }
+        ),
+        200,
+    )
+
 
 @serie_bp.route("/user-ratings/<int:user_id>/series", methods=["GET"])
 def get_user_series_ratings(user_id):
@@ -435,122 +507,52 @@ def recommend_series():
     user_favorite_genres = user.favorite_genres.split(", ")
 
     # Retrieve the series rated by the user
-    rated_series = SerieUserRating.query.filter_by(user_id=user_id).all()
-    rated_serie_ids = {rating.serie_id for rating in rated_series}
+    rated_serie_ids = seen_items.seen_ids(user_id, "serie")
 
-    # Categorize user's ratings
-    user_loves = [
-        rating.serie_id for rating in rated_series if rating.rating == "Me encanta"
-    ]
-    user_likes = [
-        rating.serie_id for rating in rated_series if rating.rating == "Me gusta"
-    ]
-    user_dislikes = [
-        rating.serie_id for rating in rated_series if rating.rating == "No me gusta"
-    ]
+    # Load the TF-IDF model of the series, fitted once and shared by the requests
+    series_tfidf = serie_tfidf.get()
 
-    # Fetch all series from the database
-    series = Serie.query.all()
-    series_df = pd.DataFrame([serie.serialize() for serie in series])
+    # Score the catalog against the taste vector of the user, the sum of the
+    # rated series weighted as 2 x loves + likes - dislikes
+    taste_vector = get_taste_vector(user.id, "serie", series_tfidf)
+    recommended_scores = series_tfidf.scores(taste_vector)
 
-    # Combine the features for each serie
-    def combine_features(row):
-        return " ".join(
-            str(row[col]).lower() for col in ["title", "director", "cast", "genres"]
-        )
+    # Filter by age restrictions and rated series with masks over the rows
+    # of the model
+    eligible_series = series_tfidf.allowed_mask(user_age, rated_serie_ids)
 
-    series_df["combined_features"] = series_df.apply(combine_features, axis=1)
-
-    # Initialize the TF-IDF Vectorizer
-    tfidf_vectorizer = TfidfVectorizer(stop_words="english")
-
-    # Fit and transform the combined features
-    tfidf_matrix = tfidf_vectorizer.fit_transform(series_df["combined_features"])
-
-    # Calculate the cosine similarity matrix
-    cosine_sim = cosine_similarity(tfidf_matrix, tfidf_matrix)
-
-    # Define the minimum age required for each rating
-    age_restrictions = {
-        "TV-Y": 0,
-        "TV-Y7": 7,
-        "TV-Y7-FV": 7,
-        "TV-G": 0,
-        "TV-PG": 10,
-        "TV-14": 14,
-        "TV-MA": 17,
-        "G": 0,
-        "PG": 10,
-        "PG-13": 13,
-        "R": 17,
-        "NC-17": 18,
-        "NR": 18,
-        "UR": 18,
-        "": 18,
-    }
+    # Organize series by genre, keeping only the top 30 of each genre and no duplicates
+    top_series_by_genre = {genre: [] for genre in user_favorite_genres}
+    seen_series = np.zeros(len(series_tfidf), dtype=bool)
 
-    # Function to get recommendations
-    def get_recommendations(
-        user_loves, user_likes, user_dislikes, cosine_sim=cosine_sim
-    ):
-        loved_serie_indices = series_df[series_df["id"].isin(user_loves)].index.tolist()
-        liked_serie_indices = series_df[series_df["id"].isin(user_likes)].index.tolist()
-        disliked_serie_indices = series_df[
-            series_df["id"].isin(user_dislikes)
-        ].index.tolist()
-
-        sim_scores_loves = np.sum(cosine_sim[loved_serie_indices], axis=0)
-        sim_scores_likes = np.sum(cosine_sim[liked_serie_indices], axis=0)
-        sim_scores_dislikes = np.sum(cosine_sim[disliked_serie_indices], axis=0)
-
-        combined_sim_scores = (
-            sim_scores_loves * 2 + sim_scores_likes - sim_scores_dislikes
+    for genre in user_favorite_genres:
+        in_genre = series_tfidf.genre_mask(genre)
+        top_series = top_k_indices(
+            recommended_scores, 30, eligible_series & in_genre & ~seen_series
         )
-
-        sim_scores = list(enumerate(combined_sim_scores))
-        sim_scores = sorted(sim_scores, key=lambda x: x[1], reverse=True)
-
-        all_liked_indices = set(
-            loved_serie_indices + liked_serie_indices + disliked_serie_indices
+        seen_series[top_series] = True
+        top_series_by_genre[genre] = series_tfidf.ids[top_series].tolist()
+
+    # Retrieve the details of the recommended series with a single query,
+    # checking the age limit again against the database, as the model may
+    # predate a change of age rating
+    recommended_ids = [
+        serie_id for ids in top_series_by_genre.values() for serie_id in ids
+    ]
+    recommended_series = {
+        serie.id: serie.serialize()
+        for serie in Serie.query.filter(
+            Serie.id.in_(recommended_ids), Serie.min_age <= user_age
         )
-        sim_scores = [
-            score for score in sim_scores if score[0] not in all_liked_indices
+    }
+    series_by_genre = {
+        genre: [
+            recommended_series[serie_id]
+            for serie_id in ids
+            if serie_id in recommended_series
         ]
-
-        serie_indices = [i[0] for i in sim_scores]
-
-        return series_df.iloc[serie_indices]
-
-    recommended_series = get_recommendations(user_loves, user_likes, user_dislikes)
-
-    # Filter by age restrictions and genres
-    def filter_series(serie):
-        serie_age_rating = age_restrictions.get(serie["age_rating"], 18)
-        if serie_age_rating > user_age or serie["id"] in rated_serie_ids:
-            return False
-        for genre in user_favorite_genres:
-            if genre.lower() in serie["genres"].lower():
-                return True
-        return False
-
-    filtered_series = recommended_series[
-        recommended_series.apply(filter_series, axis=1)
-    ]
-
-    # Organize series by genre, ensuring no duplicates
-    series_by_genre = {genre: [] for genre in user_favorite_genres}
-    seen_series = set()
-
-    for _, serie in filtered_series.iterrows():
-        for genre in user_favorite_genres:
-            if (
-                genre.lower() in serie["genres"].lower()
-                and serie["id"] not in seen_series
-            ):
-                series_by_genre[genre].append(serie.to_dict())
-                seen_series.add(serie["id"])
-                if len(series_by_genre[genre]) == 30:
-                    break
+        for genre, ids in top_series_by_genre.items()
+    }
 
     return jsonify(series_by_genre)
 
@@ -1,9 +1,12 @@
 from flask import Blueprint, request, jsonify
 from flask_jwt_extended import jwt_required
 from werkzeug.security import generate_password_hash
+from sqlalchemy.exc import IntegrityError
 
 from api.utils import APIException
-from api.models import User, MovieUserRating, SerieUserRating
+from api.seen_items import seen_items
+from api.ratings import add_ratings
+from api.models import User
 from api import db
 
 user_bp = Blueprint("user_bp", __name__)
@@ -93,7 +96,7 @@ def store_first_access_data():
     Status Codes:
         201: Successfully stored the first access data.
         400: Missing or invalid parameters.
-        404: User not found.
+        404: User, movie or serie not found.
     """
 
     body = request.get_json()
@@ -120,25 +123,18 @@ def store_first_access_data():
     movies = body["movies"]
     series = body["series"]
 
-    user.favorite_genres = genres
-
-    for movie_id in movies:
-        movie_rating = MovieUserRating(
-            user_id=user.id,
-            movie_id=movie_id,
-            rating="Me gusta",
-        )
-        db.session.add(movie_rating)
-
-    for series_id in series:
-        series_rating = SerieUserRating(
-            user_id=user.id,
-            serie_id=series_id,
-            rating="Me gusta",
-        )
-        db.session.add(series_rating)
-
-    db.session.commit()
+    # One multi-row insert per table, in the same transaction as the genres.
+    # Titles the user already rated keep their rating. The genres are set
+    # last, so the user row is only written once the ratings hold its lock
+    try:
+        add_ratings(user.id, "movie", movies, "Me gusta")
+        add_ratings(user.id, "serie", series, "Me gusta")
+        user.favorite_genres = genres
+        db.session.commit()
+    except IntegrityError:
+        db.session.rollback()
+        raise APIException("One or more movies or series not found", status_code=404)
+    seen_items.invalidate(user.id)
 
     return (
         jsonify(
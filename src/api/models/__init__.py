@@ -3,4 +3,8 @@ from .user import User
 from .movie import Movie
 from .serie import Serie
 from .movie_user_rating import MovieUserRating
-from .serie_user_rating import SerieUserRating
\ No newline at end of file
+from .serie_user_rating import SerieUserRating
+from .user_taste_vector import UserTasteVector
+from .genre import Genre
+from .movie_genre import MovieGenre
+from .serie_genre import SerieGenre
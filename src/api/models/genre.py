@@ -0,0 +1,98 @@
+from sqlalchemy import Column, Integer, String, select, insert, delete, func
+
+from api import db
+
+
+class Genre(db.Model):
+    __tablename__ = "genres"
+    id = Column(Integer, primary_key=True)
+    name = Column(String(100), unique=True, nullable=False)
+
+    def __repr__(self):
+        return "<Genre %r>" % self.name
+
+    def serialize(self):
+        return {
+            "id": self.id,
+            "name": self.name,
+        }
+
+
+def split_genres(genres):
+    """
+    Split the comma-separated genres of a title, e.g. "Action, Drama".
+
+    Returns:
+        list: The distinct genre names, in their original order.
+    """
+    names = (name.strip() for name in (genres or "").split(","))
+    return list(dict.fromkeys(name for name in names if name))
+
+
+def genre_pattern(genre):
+    """
+    Get the LIKE pattern of the genre names a requested genre selects: the
+    lowercased names that contain it, e.g. "action" selects "Action &
+    Adventure". It is the rule of `TfidfCatalog.genre_mask`, so the catalog
+    and the recommendations agree on the titles of a genre.
+
+    Returns:
+        str: The pattern, matched by `genre_matches`.
+    """
+    escaped = (
+        genre.lower().replace("\\", "\\\\").replace("%", "\\%").replace("_", "\\_")
+    )
+    return f"%{escaped}%"
+
+
+def genre_matches(pattern):
+    """
+    Filter the genres whose name matches a `genre_pattern`, given as a
+    string or as a column of patterns.
+    """
+    return func.lower(Genre.name).like(pattern, escape="\\")
+
+
+def write_genre_links(connection, title_column, title_id, genres, popularity):
+    """
+    Replace the genre links of a title, adding the genres that are not in the
+    `genres` table yet. It runs on the connection of the caller, e.g. in the
+    flush that writes the title.
+
+    Args:
+        connection (Connection): The connection to write with.
+        title_column (Column): Title id column of the link model, e.g.
+            `MovieGenre.movie_id`.
+        title_id (int): The ID of the title.
+        genres (str): The comma-separated genres of the title.
+        popularity (float): The popularity of the title.
+    """
+    link_table = title_column.table
+    names = split_genres(genres)
+    genre_ids = dict(
+        connection.execute(
+            select(Genre.name, Genre.id).where(Genre.name.in_(names))
+        ).all()
+    )
+    for name in names:
+        if name not in genre_ids:
+            result = connection.execute(insert(Genre.__table__).values(name=name))
+            genre_ids[name] = result.inserted_primary_key[0]
+
+    delete_genre_links(connection, title_column, title_id)
+    if names:
+        connection.execute(
+            insert(link_table),
+            [
+                {
+                    title_column.key: title_id,
+                    "genre_id": genre_ids[name],
+                    "popularity": popularity,
+                }
+                for name in names
+            ],
+        )
+
+
+def delete_genre_links(connection, title_column, title_id):
+    connection.execute(delete(title_column.table).where(title_column == title_id))
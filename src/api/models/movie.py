@@ -1,17 +1,23 @@
-from sqlalchemy import Column, Integer, String, Float
+from sqlalchemy import Column, Integer, String, Float, Index, event, inspect
+from sqlalchemy.orm import validates
 import pandas as pd
 
 from api import db
+from api.utils import AGE_RESTRICTIONS
+from .genre import write_genre_links, delete_genre_links
+from .movie_genre import MovieGenre
 
 
 class Movie(db.Model):
     __tablename__ = "movies"
+    __table_args__ = (Index("ix_movies_min_age_popularity", "min_age", "popularity"),)
     id = Column(Integer, primary_key=True)
     title = Column(String(300))
     director = Column(String(300))
     cast = Column(String(1000))
     country = Column(String(300))
     age_rating = Column(String(10))
+    min_age = Column(Integer, nullable=False, default=18, server_default="18")
     listed_in = Column(String(300))
     description = Column(String(2000))
     imdb_id = Column(String(20))
@@ -27,6 +33,12 @@ class Movie(db.Model):
     popularity = Column(Float)
     user_ratings = db.relationship("MovieUserRating", backref="movie", lazy=True)
 
+    @validates("age_rating")
+    def validate_age_rating(self, key, age_rating):
+        # Keep the minimum age in sync with the age rating
+        self.min_age = AGE_RESTRICTIONS.get(age_rating, 18)
+        return age_rating
+
     def __repr__(self):
         return "<Movie %r>" % self.title
 
@@ -52,3 +64,22 @@ class Movie(db.Model):
             "youtube_trailers": self.youtube_trailers,
             "popularity": self.popularity,
         }
+
+
+@event.listens_for(Movie, "after_insert")
+@event.listens_for(Movie, "after_update")
+def sync_movie_genres(mapper, connection, movie):
+    # Keep the genre links, and their copy of the popularity, in sync with
+    # the movie
+    state = inspect(movie)
+    if state.attrs.genres.history.has_changes() or (
+        state.attrs.popularity.history.has_changes()
+    ):
+        write_genre_links(
+            connection, MovieGenre.movie_id, movie.id, movie.genres, movie.popularity
+        )
+
+
+@event.listens_for(Movie, "before_delete")
+def delete_movie_genres(mapper, connection, movie):
+    delete_genre_links(connection, MovieGenre.movie_id, movie.id)
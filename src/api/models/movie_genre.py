@@ -0,0 +1,18 @@
+from sqlalchemy import Column, Integer, Float, ForeignKey, Index
+
+from api import db
+
+
+class MovieGenre(db.Model):
+    __tablename__ = "movie_genres"
+    __table_args__ = (
+        Index("ix_movie_genres_genre_id_popularity", "genre_id", "popularity"),
+    )
+    movie_id = Column(Integer, ForeignKey("movies.id"), primary_key=True)
+    genre_id = Column(Integer, ForeignKey("genres.id"), primary_key=True)
+    # Copy of the popularity of the movie, so the movies of a genre are read
+    # in popularity order from the index
+    popularity = Column(Float)
+
+    def __repr__(self):
+        return "<MovieGenre %r %r>" % (self.movie_id, self.genre_id)
@@ -1,4 +1,4 @@
-from sqlalchemy import Column, Integer, String, ForeignKey, DateTime
+from sqlalchemy import Column, Integer, String, ForeignKey, DateTime, Index
 import datetime
 
 from api import db
@@ -6,6 +6,17 @@ from api import db
 
 class MovieUserRating(db.Model):
     __tablename__ = "movie_user_ratings"
+    __table_args__ = (
+        Index(
+            "ix_movie_user_ratings_user_id_movie_id", "user_id", "movie_id", unique=True
+        ),
+        Index(
+            "ix_movie_user_ratings_user_id_rating_date_rated",
+            "user_id",
+            "rating",
+            "date_rated",
+        ),
+    )
     id = Column(Integer, primary_key=True)
     user_id = Column(Integer, ForeignKey("users.id"))
     movie_id = Column(Integer, ForeignKey("movies.id"))
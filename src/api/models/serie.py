@@ -1,17 +1,23 @@
-from sqlalchemy import Column, Integer, String, Float
+from sqlalchemy import Column, Integer, String, Float, Index, event, inspect
+from sqlalchemy.orm import validates
 import pandas as pd
 
 from api import db
+from api.utils import AGE_RESTRICTIONS
+from .genre import write_genre_links, delete_genre_links
+from .serie_genre import SerieGenre
 
 
 class Serie(db.Model):
     __tablename__ = "series"
+    __table_args__ = (Index("ix_series_min_age_popularity", "min_age", "popularity"),)
     id = Column(Integer, primary_key=True)
     title = Column(String(300))
     director = Column(String(300))
     cast = Column(String(1000))
     country = Column(String(300))
     age_rating = Column(String(10))
+    min_age = Column(Integer, nullable=False, default=18, server_default="18")
     listed_in = Column(String(300))
     description = Column(String(2000))
     imdb_id = Column(String(20))
@@ -28,6 +34,12 @@ class Serie(db.Model):
     popularity = Column(Float)
     user_ratings = db.relationship("SerieUserRating", backref="serie", lazy=True)
 
+    @validates("age_rating")
+    def validate_age_rating(self, key, age_rating):
+        # Keep the minimum age in sync with the age rating
+        self.min_age = AGE_RESTRICTIONS.get(age_rating, 18)
+        return age_rating
+
     def __repr__(self):
         return "<Serie %r>" % self.title
 
@@ -54,3 +66,22 @@ class Serie(db.Model):
             "youtube_trailers": self.youtube_trailers,
             "popularity": self.popularity,
         }
+
+
+@event.listens_for(Serie, "after_insert")
+@event.listens_for(Serie, "after_update")
+def sync_serie_genres(mapper, connection, serie):
+    # Keep the genre links, and their copy of the popularity, in sync with
+    # the serie
+    state = inspect(serie)
+    if state.attrs.genres.history.has_changes() or (
+        state.attrs.popularity.history.has_changes()
+    ):
+        write_genre_links(
+            connection, SerieGenre.serie_id, serie.id, serie.genres, serie.popularity
+        )
+
+
+@event.listens_for(Serie, "before_delete")
+def delete_serie_genres(mapper, connection, serie):
+    delete_genre_links(connection, SerieGenre.serie_id, serie.id)
@@ -0,0 +1,18 @@
+from sqlalchemy import Column, Integer, Float, ForeignKey, Index
+
+from api import db
+
+
+class SerieGenre(db.Model):
+    __tablename__ = "serie_genres"
+    __table_args__ = (
+        Index("ix_serie_genres_genre_id_popularity", "genre_id", "popularity"),
+    )
+    serie_id = Column(Integer, ForeignKey("series.id"), primary_key=True)
+    genre_id = Column(Integer, ForeignKey("genres.id"), primary_key=True)
+    # Copy of the popularity of the serie, so the series of a genre are read
+    # in popularity order from the index
+    popularity = Column(Float)
+
+    def __repr__(self):
+        return "<SerieGenre %r %r>" % (self.serie_id, self.genre_id)
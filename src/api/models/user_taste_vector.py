@@ -0,0 +1,42 @@
+from sqlalchemy import (
+    Column,
+    Integer,
+    String,
+    ForeignKey,
+    DateTime,
+    LargeBinary,
+    UniqueConstraint,
+)
+import datetime
+import numpy as np
+
+from api import db
+
+
+class UserTasteVector(db.Model):
+    __tablename__ = "user_taste_vectors"
+    __table_args__ = (UniqueConstraint("user_id", "item_type"),)
+    id = Column(Integer, primary_key=True)
+    user_id = Column(Integer, ForeignKey("users.id"), nullable=False)
+    item_type = Column(String(10), nullable=False)
+    model_version = Column(String(40), nullable=False)
+    term_indices = Column(LargeBinary, nullable=False)
+    term_weights = Column(LargeBinary, nullable=False)
+    updated_at = Column(
+        DateTime, default=datetime.datetime.now, onupdate=datetime.datetime.now
+    )
+
+    def __repr__(self):
+        return "<UserTasteVector %r>" % self.id
+
+    def to_vector(self, size):
+        vector = np.zeros(size)
+        indices = np.frombuffer(self.term_indices, dtype=np.int32)
+        vector[indices] = np.frombuffer(self.term_weights, dtype=np.float32)
+        return vector
+
+    def set_vector(self, vector, tolerance=1e-6):
+        # Only the terms with a non-zero weight are stored
+        indices = np.flatnonzero(np.abs(vector) > tolerance).astype(np.int32)
+        self.term_indices = indices.tobytes()
+        self.term_weights = vector[indices].astype(np.float32).tobytes()
@@ -0,0 +1,34 @@
+# nlp/__init__.py
+from .catalog import Catalog, ITEM_TYPES, AUDIENCES, age_bracket
+from .engine import (
+    SimilarityEngine,
+    QuantizedMatrix,
+    COMPONENTS,
+    DEFAULT_WEIGHTS,
+    PRECISIONS,
+    DEFAULT_PRECISION,
+)
+from .index import (
+    NeighborIndex,
+    build_neighbor_index,
+    DEFAULT_NEIGHBORS,
+    DEFAULT_BLOCK_SIZE,
+)
+from .ann import IVFIndex, build_ivf_index, measure_recall, DEFAULT_TARGET_RECALL
+from .model import (
+    NLPModel,
+    load_model,
+    load_raw_embedding,
+    export_model,
+    NEIGHBORS_DIR,
+    ANN_BACKENDS,
+)
+from .cache import LRUCache, DEFAULT_CACHE_SIZE
+from .holder import ModelHolder
+from .versions import (
+    version_dir,
+    current_version,
+    list_versions,
+    publish_version,
+    check_version_name,
+)
@@ -0,0 +1,296 @@
+import json
+import logging
+import os
+
+import numpy as np
+
+from api.utils import top_k_indices
+from .index import save_array
+
+logger = logging.getLogger(__name__)
+
+# Parâmetros padrão do índice IVF
+DEFAULT_TARGET_RECALL = 0.95
+DEFAULT_KMEANS_ITERATIONS = 10
+CALIBRATION_QUERIES = 200
+CALIBRATION_TOP_N = 10
+# A partir desta fração de listas sondadas, a matriz inteira é pontuada de
+# uma vez, o que equivale à busca exata e custa o mesmo que ela
+EXACT_PROBE_FRACTION = 0.5
+
+
+class IVFIndex:
+    """
+    Approximate nearest-neighbor index of the NLP catalog based on an
+    inverted file (IVF).
+
+    The concatenated embeddings of the titles are clustered with k-means.
+    A query only scores the titles of the `nprobe` clusters whose centroids
+    are the most similar to it, so with about sqrt(N) clusters the cost of
+    a query grows sublinearly with the catalog size. Increasing `nprobe`
+    trades speed for recall; probing every cluster is an exact search.
+
+    The embeddings are stored grouped by cluster, so each probed cluster is
+    scored as a contiguous slice, without copying it.
+
+    Attributes:
+        centroids (numpy.ndarray): Matrix (nlist x D) with the cluster centroids.
+        list_offsets (numpy.ndarray): Start of each cluster in `list_rows`,
+            followed by the total number of titles.
+        list_rows (numpy.ndarray): Catalog rows grouped by cluster.
+        vectors (numpy.ndarray): Matrix (N x D) with the concatenated
+            embeddings of the titles, in the order of `list_rows`. None for
+            indexes saved without it, which never match a catalog.
+        catalog_ids (numpy.ndarray): Ids of the catalog the index was built for.
+        nprobe (int): Number of clusters probed by default per query.
+        recall (float): Recall@10 against the exact search measured for
+            `nprobe` when the index was built.
+    """
+
+    name = "ivf"
+
+    def __init__(
+        self,
+        centroids,
+        list_offsets,
+        list_rows,
+        vectors,
+        catalog_ids,
+        nprobe=1,
+        recall=None,
+    ):
+        self.centroids = centroids
+        self.list_offsets = list_offsets
+        self.list_rows = list_rows
+        self.vectors = vectors
+        self.catalog_ids = catalog_ids
+        self.nprobe = nprobe
+        self.recall = recall
+
+    @property
+    def nlist(self):
+        return len(self.centroids)
+
+    @property
+    def exhaustive(self):
+        # Sondar tantas listas por padrão não é mais rápido que a busca exata
+        return self.nprobe >= EXACT_PROBE_FRACTION * self.nlist
+
+    @classmethod
+    def load(cls, path, mmap_mode="r"):
+        arrays = [
+            np.load(os.path.join(path, f"{name}.npy"), mmap_mode=mmap_mode)
+            for name in ("centroids", "list_offsets", "list_rows")
+        ]
+        # Índices salvos antes de guardar os vetores não são mais usados
+        vectors_path = os.path.join(path, "vectors.npy")
+        arrays.append(
+            np.load(vectors_path, mmap_mode=mmap_mode)
+            if os.path.exists(vectors_path)
+            else None
+        )
+        arrays.append(
+            np.load(os.path.join(path, "catalog_ids.npy"), mmap_mode=mmap_mode)
+        )
+        with open(os.path.join(path, "params.json")) as f:
+            params = json.load(f)
+        return cls(*arrays, nprobe=params["nprobe"], recall=params.get("recall"))
+
+    def save(self, path):
+        os.makedirs(path, exist_ok=True)
+        save_array(os.path.join(path, "centroids.npy"), self.centroids)
+        save_array(os.path.join(path, "list_offsets.npy"), self.list_offsets)
+        save_array(os.path.join(path, "list_rows.npy"), self.list_rows)
+        save_array(os.path.join(path, "vectors.npy"), self.vectors)
+        save_array(os.path.join(path, "catalog_ids.npy"), self.catalog_ids)
+
+        tmp_path = os.path.join(path, "params.json.tmp")
+        with open(tmp_path, "w") as f:
+            json.dump({"nprobe": self.nprobe, "recall": self.recall}, f)
+        os.replace(tmp_path, os.path.join(path, "params.json"))
+
+    def matches(self, catalog_ids):
+        return self.vectors is not None and np.array_equal(
+            self.catalog_ids, np.asarray(catalog_ids)
+        )
+
+    def candidates(self, query, nprobe=None):
+        """
+        Score the titles of the clusters most similar to a query.
+
+        When at least `EXACT_PROBE_FRACTION` of the clusters are probed,
+        every title is scored with a single product instead, which is the
+        exact search.
+
+        Args:
+            query (numpy.ndarray): Query vector, see `SimilarityEngine.query_vector`.
+            nprobe (int): Number of clusters to probe. Default is `self.nprobe`.
+
+        Returns:
+            tuple: The catalog rows of the titles of the probed clusters and
+                their combined similarity to the query.
+        """
+        nprobe = min(nprobe or self.nprobe, self.nlist)
+        if nprobe >= EXACT_PROBE_FRACTION * self.nlist:
+            return self.list_rows, self.vectors @ query
+
+        centroid_scores = self.centroids @ query
+        probed = np.sort(np.argpartition(-centroid_scores, nprobe - 1)[:nprobe])
+        lists = [slice(self.list_offsets[c], self.list_offsets[c + 1]) for c in probed]
+        rows = np.concatenate([self.list_rows[part] for part in lists])
+        scores = np.concatenate([self.vectors[part] @ query for part in lists])
+        return rows, scores
+
+    def search(self, engine, idx, mask, top_n, nprobe=None, weights=None):
+        """
+        Get the most similar allowed titles to a given one.
+
+        When the probed clusters do not contain `top_n` allowed titles, the
+        number of probed clusters is doubled until they do or every cluster
+        has been probed.
+
+        Args:
+            engine (SimilarityEngine): Engine that provides the query vector.
+            idx (int): Row of the seed title in the catalog.
+            mask (numpy.ndarray): Boolean mask of the allowed titles.
+            top_n (int): Number of titles to return.
+            nprobe (int): Number of clusters to probe first. Default is `self.nprobe`.
+            weights (dict): Weight of each component for this query. Default
+                is the weights of the engine.
+
+        Returns:
+            numpy.ndarray: Catalog rows of the titles, from most to least similar.
+        """
+        query = engine.query_vector(idx, weights).astype(self.vectors.dtype)
+        nprobe = min(nprobe or self.nprobe, self.nlist)
+        while True:
+            rows, scores = self.candidates(query, nprobe)
+            allowed = mask[rows]
+            if np.count_nonzero(allowed) >= top_n or nprobe >= self.nlist:
+                break
+            nprobe = min(nprobe * 2, self.nlist)
+
+        # Pontuações na ordem do catálogo, para desempatar pela linha como na
+        # busca exata
+        catalog_scores = np.zeros(len(mask), dtype=scores.dtype)
+        catalog_scores[rows] = scores
+        candidates = np.zeros(len(mask), dtype=bool)
+        candidates[rows[allowed]] = True
+        return top_k_indices(catalog_scores, top_n, candidates)
+
+
+def kmeans(vectors, nlist, iterations=DEFAULT_KMEANS_ITERATIONS, seed=0):
+    """
+    Cluster vectors with k-means, assigning each one to the centroid with
+    the highest inner product.
+
+    Returns:
+        tuple: The centroids (nlist x D) and the cluster of each vector.
+    """
+    rng = np.random.default_rng(seed)
+    centroids = vectors[rng.choice(len(vectors), nlist, replace=False)].copy()
+
+    for _ in range(iterations):
+        assignments = np.argmax(vectors @ centroids.T, axis=1)
+        counts = np.bincount(assignments, minlength=nlist)
+        sums = np.zeros_like(centroids)
+        np.add.at(sums, assignments, vectors)
+
+        empty = counts == 0
+        centroids[~empty] = sums[~empty] / counts[~empty, None]
+        # Clusters vazios recebem um vetor aleatório como novo centróide
+        centroids[empty] = vectors[rng.choice(len(vectors), empty.sum())]
+
+    return centroids, np.argmax(vectors @ centroids.T, axis=1)
+
+
+def build_ivf_index(
+    engine,
+    catalog_ids,
+    nlist=None,
+    target_recall=DEFAULT_TARGET_RECALL,
+    iterations=DEFAULT_KMEANS_ITERATIONS,
+):
+    """
+    Build the IVF index of the catalog and calibrate its default `nprobe`.
+
+    The default `nprobe` is the smallest number of probed clusters whose
+    mean recall@10 against the exact search, measured on a sample of
+    titles, reaches `target_recall`.
+
+    Args:
+        engine (SimilarityEngine): Engine with the embeddings of the catalog.
+        catalog_ids (array-like): Ids of the titles, in catalog order.
+        nlist (int): Number of clusters. Default is sqrt(N).
+        target_recall (float): Recall@10 required from the default `nprobe`.
+        iterations (int): Number of k-means iterations.
+
+    Returns:
+        IVFIndex: The calibrated index.
+    """
+    vectors = engine.stacked(np.arange(engine.size)).astype(np.float32)
+    nlist = nlist or max(1, int(np.sqrt(engine.size)))
+    centroids, assignments = kmeans(vectors, nlist, iterations)
+
+    order = np.argsort(assignments, kind="stable")
+    list_offsets = np.zeros(nlist + 1, dtype=np.int64)
+    list_offsets[1:] = np.cumsum(np.bincount(assignments, minlength=nlist))
+
+    index = IVFIndex(
+        centroids,
+        list_offsets,
+        order.astype(np.int32),
+        vectors[order],
+        np.asarray(catalog_ids),
+    )
+
+    nprobe = 1
+    while True:
+        recall = measure_recall(engine, index, nprobe)
+        if recall >= target_recall or nprobe >= nlist:
+            break
+        nprobe = min(nprobe * 2, nlist)
+    index.nprobe = nprobe
+    index.recall = recall
+    if index.exhaustive:
+        logger.warning(
+            "Reaching a recall of %s takes %s of the %s IVF lists, so the index "
+            "falls back to the exact search and is not faster than it",
+            target_recall,
+            nprobe,
+            nlist,
+        )
+    return index
+
+
+def measure_recall(
+    engine, index, nprobe, queries=CALIBRATION_QUERIES, top_n=CALIBRATION_TOP_N
+):
+    """
+    Measure the mean recall@top_n of an index against the exact search.
+
+    Args:
+        engine (SimilarityEngine): Engine with the embeddings of the catalog.
+        index (IVFIndex): Index to evaluate.
+        nprobe (int): Number of clusters probed per query.
+        queries (int): Number of titles sampled as queries.
+        top_n (int): Number of neighbors compared per query.
+
+    Returns:
+        float: Fraction of the exact top_n neighbors found by the index.
+    """
+    rng = np.random.default_rng(0)
+    sample = rng.choice(engine.size, min(queries, engine.size), replace=False)
+    mask = np.ones(engine.size, dtype=bool)
+
+    found = 0
+    for idx in sample:
+        mask[idx] = False
+        exact = engine.similarity_row(idx)
+        exact[idx] = -np.inf
+        expected = np.argpartition(-exact, top_n - 1)[:top_n]
+        approximate = index.search(engine, idx, mask, top_n, nprobe=nprobe)
+        found += len(np.intersect1d(expected, approximate))
+        mask[idx] = True
+
+    return found / (len(sample) * top_n)
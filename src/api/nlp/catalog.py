@@ -0,0 +1,93 @@
+from bisect import bisect_right
+
+import numpy as np
+
+# Tipos de título do catálogo NLP e públicos ordenados pela idade mínima
+ITEM_TYPES = ("movie", "tv-show")
+AUDIENCES = ("all audiences", "children", "youngs", "teenagers", "adults")
+
+# Idade a partir da qual cada público seguinte passa a ser permitido
+AUDIENCE_MIN_AGES = (6, 12, 15, 18)
+
+
+def age_bracket(user_age):
+    """
+    Get the age bracket of a user.
+
+    Args:
+        user_age (int): The age of the user.
+
+    Returns:
+        int: Index of the most restrictive audience the user can watch in
+            `AUDIENCES`; every audience up to it is allowed.
+    """
+    return bisect_right(AUDIENCE_MIN_AGES, user_age)
+
+
+def encode(values, labels):
+    codes = {label: code for code, label in enumerate(labels)}
+    return np.array([codes.get(value, -1) for value in values], dtype=np.int8)
+
+
+class Catalog:
+    """
+    Columns of the NLP catalog stored as contiguous NumPy arrays.
+
+    The type and public of each title are integer coded and the allowed
+    titles of every (type, age bracket) pair are precomputed as boolean
+    masks, so recommendations are filtered with whole-array operations.
+
+    Attributes:
+        ids (numpy.ndarray): Id of each title, in catalog order.
+        type_codes (numpy.ndarray): Index of the type of each title in `ITEM_TYPES`.
+        public_codes (numpy.ndarray): Index of the public of each title in `AUDIENCES`.
+    """
+
+    def __init__(self, ids, type_codes, public_codes):
+        self.ids = ids
+        self.type_codes = type_codes
+        self.public_codes = public_codes
+        self.rows = {item_id: row for row, item_id in enumerate(self.ids.tolist())}
+
+        known_public = self.public_codes >= 0
+        self.masks = {
+            (item_type, bracket): (self.type_codes == type_code)
+            & known_public
+            & (self.public_codes <= bracket)
+            for type_code, item_type in enumerate(ITEM_TYPES)
+            for bracket in range(len(AUDIENCES))
+        }
+
+    @classmethod
+    def from_frame(cls, df):
+        return cls(
+            np.ascontiguousarray(df["id"].to_numpy(), dtype=np.int64),
+            encode(df["type"].tolist(), ITEM_TYPES),
+            encode(df["public"].tolist(), AUDIENCES),
+        )
+
+    def __len__(self):
+        return len(self.ids)
+
+    def row(self, item_id):
+        return self.rows[item_id]
+
+    def allowed_mask(self, item_type, user_age):
+        """
+        Get the titles of a type that a user is allowed to watch.
+
+        Args:
+            item_type (str): Type of the titles, "movie" or "tv-show".
+            user_age (int): The age of the user.
+
+        Returns:
+            numpy.ndarray: Boolean mask over the catalog. It must not be
+                modified, as it is shared between requests.
+        """
+        mask = self.masks.get((item_type, age_bracket(user_age)))
+        if mask is None:
+            return np.zeros(len(self), dtype=bool)
+        return mask
+
+    def seen_mask(self, seen_ids):
+        return np.isin(self.ids, np.fromiter(seen_ids, dtype=np.int64))
@@ -0,0 +1,265 @@
+import numpy as np
+from scipy import sparse
+from sklearn.preprocessing import normalize
+
+# Componentes do embedding e o peso de cada um na similaridade combinada
+COMPONENTS = ("description", "director", "genres")
+DEFAULT_WEIGHTS = {"description": 0.5, "director": 0.3, "genres": 0.2}
+
+# Precisões suportadas para guardar os embeddings
+PRECISIONS = ("float64", "float32", "int8")
+DEFAULT_PRECISION = "float32"
+
+# Linhas desquantizadas de uma vez ao multiplicar uma matriz int8
+QUANTIZED_BLOCK_SIZE = 4096
+
+
+class QuantizedMatrix:
+    """
+    Matrix stored as int8 values with one float32 scale per row.
+
+    Each row is scaled so that its largest absolute value maps to 127, which
+    takes a quarter of the memory of float32 rows. Rows are converted back
+    to float32 only when they are used, in blocks of `QUANTIZED_BLOCK_SIZE`.
+
+    Attributes:
+        values (numpy.ndarray): Quantized matrix (N x D) of int8 values.
+        scales (numpy.ndarray): Scale of each row, so that row i is
+            approximately `values[i] * scales[i]`.
+    """
+
+    def __init__(self, values, scales):
+        self.values = values
+        self.scales = scales
+
+    @classmethod
+    def quantize(cls, matrix):
+        matrix = np.asarray(matrix, dtype=np.float32)
+        scales = np.abs(matrix).max(axis=1) / 127
+        safe_scales = np.where(scales > 0, scales, 1)
+        values = np.rint(matrix / safe_scales[:, None]).astype(np.int8)
+        return cls(values, scales.astype(np.float32))
+
+    @property
+    def shape(self):
+        return self.values.shape
+
+    @property
+    def nbytes(self):
+        return self.values.nbytes + self.scales.nbytes
+
+    def __getitem__(self, rows):
+        return self.values[rows].astype(np.float32) * self.scales[rows, None]
+
+    def __matmul__(self, other):
+        result = np.empty((self.shape[0],) + other.shape[1:], dtype=np.float32)
+        for start in range(0, self.shape[0], QUANTIZED_BLOCK_SIZE):
+            block = slice(start, start + QUANTIZED_BLOCK_SIZE)
+            result[block] = self[block] @ other
+        return result
+
+
+def dense_rows(matrix, rows):
+    """
+    Get one row (for an integer) or several rows of an embedding matrix as
+    a dense array, whether the matrix is dense, quantized or sparse.
+    """
+    if sparse.issparse(matrix):
+        result = matrix[rows].toarray()
+        return result[0] if np.ndim(rows) == 0 else result
+    return np.asarray(matrix[rows])
+
+
+def matrix_nbytes(matrix):
+    if sparse.issparse(matrix):
+        return matrix.data.nbytes + matrix.indices.nbytes + matrix.indptr.nbytes
+    return matrix.nbytes
+
+
+def with_precision(matrix, precision):
+    """
+    Convert a normalized embedding matrix to a precision, without copying
+    it when it already has that precision (e.g. memory-mapped artifacts).
+
+    Sparse matrices are kept in CSR format. They are not quantized, so they
+    are kept in float32 when the precision is "int8".
+    """
+    if precision not in PRECISIONS:
+        raise ValueError(f"Unknown precision: {precision}")
+
+    if sparse.issparse(matrix):
+        dtype = np.dtype(np.float32 if precision == "int8" else precision)
+        matrix = matrix.tocsr()
+        return matrix if matrix.dtype == dtype else matrix.astype(dtype)
+
+    if isinstance(matrix, QuantizedMatrix):
+        if precision == "int8":
+            return matrix
+        matrix = matrix[:]
+
+    if precision == "int8":
+        return QuantizedMatrix.quantize(matrix)
+    if matrix.dtype == np.dtype(precision):
+        return matrix
+    return np.asarray(matrix, dtype=precision)
+
+
+class SimilarityEngine:
+    """
+    Content similarity between titles of the NLP catalog.
+
+    Only the row-normalized embeddings of each component are kept in memory.
+    The cosine similarity of a title against the whole catalog is computed
+    when it is requested, so memory grows linearly with the catalog size
+    instead of holding one N x N matrix per component.
+
+    Args:
+        embeddings (dict): Embedding matrix of each component. SciPy sparse
+            matrices (e.g. TF-IDF features) are kept in CSR format and scored
+            with sparse-dense products, without being densified.
+        weights (dict): Weight of each component. Default is `DEFAULT_WEIGHTS`.
+        normalized (bool): Whether the rows of the embeddings are already
+            L2-normalized, in which case they are kept as given. Default is False.
+        precision (str): Storage precision of the embeddings, one of
+            `PRECISIONS`. Default is `DEFAULT_PRECISION`.
+
+    Attributes:
+        embeddings (dict): Row-normalized embedding matrix of each component.
+        weights (dict): Weight of each component in the combined similarity.
+        precision (str): Storage precision of the embeddings.
+        size (int): Number of titles in the catalog.
+    """
+
+    def __init__(
+        self, embeddings, weights=None, normalized=False, precision=DEFAULT_PRECISION
+    ):
+        self.precision = precision
+        self.embeddings = {}
+        for name in COMPONENTS:
+            matrix = embeddings[name]
+            if not normalized and sparse.issparse(matrix):
+                matrix = normalize(matrix.tocsr().astype(np.float64))
+            elif not normalized:
+                matrix = normalize(np.asarray(matrix, dtype=np.float64))
+            # Matrizes já normalizadas na precisão pedida (ex.: memory-mapped)
+            # são usadas sem cópia
+            self.embeddings[name] = with_precision(matrix, precision)
+        self.weights = dict(weights or DEFAULT_WEIGHTS)
+
+        sizes = {matrix.shape[0] for matrix in self.embeddings.values()}
+        if len(sizes) != 1:
+            raise ValueError("All embeddings must have the same number of rows.")
+        self.size = sizes.pop()
+
+    @property
+    def dtype(self):
+        return np.float64 if self.precision == "float64" else np.float32
+
+    @property
+    def nbytes(self):
+        return sum(matrix_nbytes(matrix) for matrix in self.embeddings.values())
+
+    def similarity_row(self, idx, weights=None):
+        """
+        Compute the combined similarity of one title against the catalog.
+
+        Args:
+            idx (int): Row of the title in the catalog.
+            weights (dict): Weight of each component for this query. Default
+                is `self.weights`.
+
+        Returns:
+            numpy.ndarray: Array of length `size` with the weighted cosine
+                similarity of every title to the given one.
+        """
+        return self.similarity_rows([idx], weights)[0]
+
+    def similarity_rows(self, rows, weights=None):
+        """
+        Compute the combined similarity of several titles against the catalog.
+
+        Args:
+            rows (list): Rows of the titles in the catalog.
+            weights (dict): Weight of each component for this query. Default
+                is `self.weights`.
+
+        Returns:
+            numpy.ndarray: Matrix of shape (len(rows), size) with the weighted
+                cosine similarity of every queried title to the catalog.
+        """
+        scores = np.zeros((self.size, len(rows)), dtype=self.dtype)
+        for name, weight in (weights or self.weights).items():
+            matrix = self.embeddings[name]
+            scores += weight * (matrix @ dense_rows(matrix, rows).T)
+        return scores.T
+
+    def profile_scores(self, rows, coefficients, weights=None):
+        """
+        Compute the weighted sum of the similarities of several titles
+        against the catalog.
+
+        The rows are first combined into one profile vector per component,
+        so the catalog is scored with a single matrix-vector product per
+        component instead of one per title.
+
+        Args:
+            rows (list): Rows of the titles in the catalog.
+            coefficients (list): Weight of each title in the sum. Negative
+                weights push the titles similar to it down.
+            weights (dict): Weight of each component for this query. Default
+                is `self.weights`.
+
+        Returns:
+            numpy.ndarray: Array of length `size` with the combined score of
+                every title of the catalog.
+        """
+        coefficients = np.asarray(coefficients, dtype=self.dtype)
+        scores = np.zeros(self.size, dtype=self.dtype)
+        for name, weight in (weights or self.weights).items():
+            matrix = self.embeddings[name]
+            profile = matrix[rows].T @ coefficients
+            scores += weight * (matrix @ profile)
+        return scores
+
+    def similarity_subset(self, idx, rows, weights=None):
+        """
+        Compute the combined similarity of one title against some titles.
+
+        Args:
+            idx (int): Row of the title in the catalog.
+            rows (numpy.ndarray): Rows of the titles to compare it with.
+            weights (dict): Weight of each component for this query. Default
+                is `self.weights`.
+
+        Returns:
+            numpy.ndarray: Array of length len(rows) with the weighted cosine
+                similarity of each of those titles to the given one.
+        """
+        scores = np.zeros(len(rows), dtype=self.dtype)
+        for name, weight in (weights or self.weights).items():
+            matrix = self.embeddings[name]
+            scores += weight * (matrix[rows] @ dense_rows(matrix, idx))
+        return scores
+
+    def stacked(self, rows):
+        """
+        Get the embeddings of some titles concatenated across components.
+
+        The inner product between a `query_vector` and these rows is the
+        combined similarity, which lets vector indexes work on a single matrix.
+        """
+        return np.hstack(
+            [dense_rows(self.embeddings[name], rows) for name in COMPONENTS]
+        )
+
+    def query_vector(self, idx, weights=None):
+        """
+        Get the concatenated embedding of a title scaled by the component weights.
+        """
+        weights = weights or self.weights
+        return np.concatenate(
+            [
+                weights[name] * dense_rows(self.embeddings[name], idx)
+                for name in COMPONENTS
+            ]
+        )
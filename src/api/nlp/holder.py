@@ -0,0 +1,210 @@
+import logging
+import os
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+# Espera antes de tentar de novo uma versão que falhou ao carregar, dobrada a
+# cada falha seguida até o máximo
+DEFAULT_RETRY_INTERVAL = 5
+MAX_RETRY_INTERVAL = 300
+
+
+class ModelHolder:
+    """
+    Holds the NLP model while it is loaded outside of the request path.
+
+    The model is loaded on a background thread, so the application can serve
+    the endpoints that do not depend on it while it warms up. After a fork
+    (e.g. gunicorn workers of a preloaded app) a load that was still running
+    in the parent is restarted on the next call to `start` or `get`.
+
+    When the published version of the artifacts changes, the new model is
+    loaded on a background thread as well and swapped in once it is ready.
+    Requests that already got the previous model finish with it; if the new
+    version fails to load, the previous model keeps being served.
+
+    A version that fails to load is tried again by the watcher, or by `get`
+    when there is no watcher, after `retry_interval` seconds. The wait
+    doubles after each consecutive failure, up to `MAX_RETRY_INTERVAL`.
+
+    Args:
+        loader (callable): Function that returns the model of the version
+            it receives.
+        version (callable): Function without arguments that returns the
+            published version. Default is None (always version None).
+        poll_interval (float): Seconds between checks of the published
+            version, or 0 to only reload when `reload` is called. Default is 0.
+        retry_interval (float): Seconds before the first retry of a version
+            that failed to load. Default is `DEFAULT_RETRY_INTERVAL`.
+
+    Attributes:
+        status (str): "idle", "loading", "ready" or "failed".
+        error (str): Description of the last loading error, if any.
+        version (str): Version of the model being served.
+    """
+
+    def __init__(
+        self,
+        loader,
+        version=None,
+        poll_interval=0,
+        retry_interval=DEFAULT_RETRY_INTERVAL,
+    ):
+        self._loader = loader
+        self._version = version or (lambda: None)
+        self._poll_interval = poll_interval
+        self._retry_interval = retry_interval
+        self._failures = 0
+        self._retry_at = None
+        self._model = None
+        self._thread = None
+        self._watcher = None
+        self._lock = threading.Lock()
+        self.status = "idle"
+        self.error = None
+        self.version = None
+        self._requested = None
+
+        if hasattr(os, "register_at_fork"):
+            os.register_at_fork(after_in_child=self._after_fork)
+
+    def _after_fork(self):
+        # Apenas a thread que chamou fork sobrevive no processo filho
+        self._lock = threading.Lock()
+        self._thread = None
+        self._watcher = None
+        if self.status == "loading":
+            self.status = "idle"
+
+    def _load(self, version):
+        try:
+            model = self._loader(version)
+        except Exception as e:
+            logger.exception("Failed to load version %s of the NLP model", version)
+            self.error = str(e)
+            self._failures += 1
+            delay = min(
+                self._retry_interval * 2 ** (self._failures - 1), MAX_RETRY_INTERVAL
+            )
+            self._retry_at = time.monotonic() + delay
+            if self._model is None:
+                self.status = "failed"
+        else:
+            # Troca atômica: quem já tem a referência antiga continua com ela
+            self._model = model
+            self.version = version
+            self.error = None
+            self._failures = 0
+            self._retry_at = None
+            self.status = "ready"
+            logger.info("Serving version %s of the NLP model", version)
+
+    def _spawn(self, version):
+        # Deve ser chamado com o lock adquirido
+        self._requested = version
+        self._thread = threading.Thread(
+            target=self._load, args=(version,), name="nlp-model-loader", daemon=True
+        )
+        self._thread.start()
+
+    def _watch(self):
+        while True:
+            time.sleep(self._poll_interval)
+            if self.status not in ("ready", "failed"):
+                continue
+            try:
+                self.reload()
+            except Exception:
+                logger.exception("Failed to check the NLP model version")
+
+    def _start_watcher(self):
+        # Deve ser chamado com o lock adquirido
+        if self._poll_interval and self._watcher is None:
+            self._watcher = threading.Thread(
+                target=self._watch, name="nlp-model-watcher", daemon=True
+            )
+            self._watcher.start()
+
+    def start(self):
+        """
+        Start loading the model on a background thread, unless it is already
+        loaded or being loaded, and start watching the published version.
+        """
+        with self._lock:
+            self._start_watcher()
+            if self.status in ("loading", "ready"):
+                return
+            self.status = "loading"
+            self._spawn(self._version())
+
+    def _retry_due(self):
+        retry_at = self._retry_at
+        return retry_at is not None and time.monotonic() >= retry_at
+
+    def reload(self, force=False):
+        """
+        Load the published version on a background thread if it changed
+        since the last load, or if its last load failed and the wait before
+        retrying it is over.
+
+        Args:
+            force (bool): Reload even if the version did not change, e.g. to
+                retry a version that failed to load.
+
+        Returns:
+            bool: True if a load was started.
+        """
+        version = self._version()
+        with self._lock:
+            if self._thread is not None and self._thread.is_alive():
+                return False
+            if version == self._requested and not force and not self._retry_due():
+                return False
+            if self.status != "ready":
+                self.status = "loading"
+            self._spawn(version)
+            return True
+
+    def get(self):
+        """
+        Get the model without waiting for it.
+
+        Returns:
+            NLPModel: The model, or None if it is not ready yet. Loading is
+                started if it had not been, or retried if it failed and
+                nothing else retries it.
+        """
+        if self.status == "idle":
+            self.start()
+        elif self.status == "failed" and self._watcher is None and self._retry_due():
+            self.reload()
+        return self._model
+
+    def wait(self):
+        """
+        Get the model, loading it and waiting for it if needed.
+
+        Returns:
+            NLPModel: The loaded model.
+
+        Raises:
+            RuntimeError: If the model could not be loaded.
+        """
+        self.start()
+        thread = self._thread
+        if thread is not None:
+            thread.join()
+        if self.status != "ready":
+            raise RuntimeError(f"The NLP model could not be loaded: {self.error}")
+        return self._model
+
+    @property
+    def ready(self):
+        return self.status == "ready"
+
+    @property
+    def reloading(self):
+        thread = self._thread
+        return self.status == "ready" and thread is not None and thread.is_alive()
@@ -0,0 +1,137 @@
+import os
+
+import numpy as np
+from scipy import sparse
+
+from api.utils import top_k_indices
+
+# Número de vizinhos guardados por título e tamanho do bloco usado na construção
+DEFAULT_NEIGHBORS = 200
+DEFAULT_BLOCK_SIZE = 512
+
+
+def save_array(path, array):
+    """
+    Save an array as a `.npy` file without touching the file it replaces.
+
+    The array is written to a temporary file that is then renamed over
+    `path`, so processes that have the previous file memory-mapped keep
+    reading it safely.
+    """
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, "wb") as f:
+        np.save(f, array)
+    os.replace(tmp_path, path)
+
+
+def save_sparse(path, matrix):
+    """
+    Save a sparse matrix as an uncompressed `.npz` file, replacing the
+    previous file atomically like `save_array`.
+    """
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, "wb") as f:
+        sparse.save_npz(f, matrix, compressed=False)
+    os.replace(tmp_path, path)
+
+
+class NeighborIndex:
+    """
+    Precomputed top-K neighbors of every title of the NLP catalog.
+
+    The index is built offline with `build_neighbor_index` and stored as
+    `.npy` files in a directory, opened memory-mapped so that every worker
+    shares the same pages. Serving a title only reads its K neighbors
+    instead of scoring and sorting the whole catalog.
+
+    Attributes:
+        rows (numpy.ndarray): Matrix (N x K) with the catalog rows of the
+            neighbors of each title, ordered by descending similarity.
+        scores (numpy.ndarray): Matrix (N x K) with the similarity of each neighbor.
+        catalog_ids (numpy.ndarray): Ids of the catalog the index was built for.
+    """
+
+    def __init__(self, rows, scores, catalog_ids):
+        self.rows = rows
+        self.scores = scores
+        self.catalog_ids = catalog_ids
+
+    @classmethod
+    def load(cls, path, mmap_mode="r"):
+        return cls(
+            *(
+                np.load(os.path.join(path, f"{name}.npy"), mmap_mode=mmap_mode)
+                for name in ("rows", "scores", "catalog_ids")
+            )
+        )
+
+    def save(self, path):
+        os.makedirs(path, exist_ok=True)
+        save_array(os.path.join(path, "rows.npy"), self.rows)
+        save_array(os.path.join(path, "scores.npy"), self.scores)
+        save_array(os.path.join(path, "catalog_ids.npy"), self.catalog_ids)
+
+    def matches(self, catalog_ids):
+        return np.array_equal(self.catalog_ids, np.asarray(catalog_ids))
+
+    def neighbors(self, idx):
+        """
+        Get the precomputed neighbors of a title.
+
+        Args:
+            idx (int): Row of the title in the catalog.
+
+        Returns:
+            tuple: Arrays with the catalog rows of the neighbors and their
+                similarity, ordered by descending similarity.
+        """
+        return self.rows[idx], self.scores[idx]
+
+
+def build_neighbor_index(
+    engine, catalog_ids, k=DEFAULT_NEIGHBORS, block_size=DEFAULT_BLOCK_SIZE
+):
+    """
+    Build the top-K neighbor index of the catalog.
+
+    The similarity is computed in blocks of `block_size` titles, so the
+    memory used is bounded by a (block_size x N) matrix regardless of the
+    catalog size.
+
+    Args:
+        engine (SimilarityEngine): Engine used to score the titles.
+        catalog_ids (array-like): Ids of the titles, in catalog order.
+        k (int): Number of neighbors kept per title.
+        block_size (int): Number of titles scored at once.
+
+    Returns:
+        NeighborIndex: The index of the catalog.
+    """
+    size = engine.size
+    k = min(k, size - 1)
+    rows = np.empty((size, k), dtype=np.int32)
+    scores = np.empty((size, k), dtype=np.float32)
+
+    for start in range(0, size, block_size):
+        block = np.arange(start, min(start + block_size, size))
+        block_scores = engine.similarity_rows(block)
+        # O próprio título nunca é vizinho de si mesmo
+        block_scores[np.arange(len(block)), block] = -np.inf
+
+        top = np.argpartition(-block_scores, k - 1, axis=1)[:, :k]
+        top_scores = np.take_along_axis(block_scores, top, axis=1)
+
+        # Empates no limite de k ficam com as menores linhas, como na busca
+        # exata, e os empates dentro do top-k são ordenados pela linha
+        kth_scores = top_scores.min(axis=1, keepdims=True)
+        tied = (block_scores == kth_scores).sum(axis=1)
+        tied_taken = (top_scores == kth_scores).sum(axis=1)
+        for row in np.flatnonzero(tied > tied_taken):
+            top[row] = top_k_indices(block_scores[row], k)
+            top_scores[row] = block_scores[row, top[row]]
+        order = np.lexsort((top, -top_scores), axis=1)
+
+        rows[block] = np.take_along_axis(top, order, axis=1)
+        scores[block] = np.take_along_axis(top_scores, order, axis=1)
+
+    return NeighborIndex(rows, scores, np.asarray(catalog_ids))
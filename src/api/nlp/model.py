@@ -0,0 +1,462 @@
+import json
+import logging
+import os
+
+import numpy as np
+import pandas as pd
+from scipy import sparse
+
+from api.utils import top_k_indices
+from .catalog import Catalog, age_bracket
+from .cache import LRUCache, DEFAULT_CACHE_SIZE
+from .engine import SimilarityEngine, QuantizedMatrix, COMPONENTS, DEFAULT_PRECISION
+from .index import NeighborIndex, save_array, save_sparse
+from .ann import IVFIndex
+
+logger = logging.getLogger(__name__)
+
+# Artefatos gerados a partir dos arquivos originais do modelo NLP
+COMPILED_DIR = "compiled"
+# Registro, dentro de compiled/, dos arquivos originais usados na exportação
+SOURCES_FILE = "sources.json"
+CATALOG_FILE = "df_netflix_bd.csv"
+NEIGHBORS_DIR = "neighbors"
+CATALOG_COLUMNS = ("ids", "type_codes", "public_codes")
+
+# Backends de busca aproximada disponíveis, guardados em nlp_resources/<nome>/
+ANN_BACKENDS = {IVFIndex.name: IVFIndex}
+
+# Candidatos guardados por semente no cache, o suficiente para descartar os
+# itens já vistos pela maioria dos usuários
+DEFAULT_CANDIDATE_DEPTH = 50
+
+
+class NLPModel:
+    """
+    Everything needed to serve the NLP recommendations.
+
+    Attributes:
+        catalog (Catalog): Ids, types and publics of the titles.
+        engine (SimilarityEngine): Similarity between the titles.
+        neighbor_index (NeighborIndex): Precomputed neighbors of each title,
+            or None if no index matching the catalog is available.
+        ann_index (IVFIndex): Approximate nearest-neighbor index used instead
+            of the exact search, or None to always search exactly.
+        candidate_cache (LRUCache): Ranked candidates of the most recent
+            seeds, by seed, type and age bracket. It is emptied with the
+            model when a new version is loaded.
+        candidate_depth (int): Number of ranked candidates cached per seed.
+        sources (dict): Size and modification time of the original files the
+            model was built from, by file name, or None if unknown.
+    """
+
+    def __init__(
+        self,
+        catalog,
+        engine,
+        neighbor_index=None,
+        ann_index=None,
+        cache_size=DEFAULT_CACHE_SIZE,
+        candidate_depth=DEFAULT_CANDIDATE_DEPTH,
+        sources=None,
+    ):
+        self.catalog = catalog
+        self.engine = engine
+        self.neighbor_index = neighbor_index
+        self.ann_index = ann_index
+        self.candidate_cache = LRUCache(cache_size)
+        self.candidate_depth = candidate_depth
+        self.sources = sources
+
+    def recommend(self, item_id, item_type, user_age, seen_ids, top_n=10, weights=None):
+        """
+        Recommend titles similar to a given one.
+
+        Args:
+            item_id (int): Id of the title used as seed.
+            item_type (str): Type of the recommended titles, "movie" or "tv-show".
+            user_age (int): The age of the user.
+            seen_ids (set): Ids of the titles already rated by the user.
+            top_n (int): Number of titles to recommend. Default is 10.
+            weights (dict): Weight of each embedding component. Default is
+                the weights of the engine.
+
+        Returns:
+            list: Ids of the recommended titles, from most to least similar.
+        """
+        return self.recommend_many(
+            [item_id], item_type, user_age, seen_ids, top_n, weights
+        )[0]
+
+    def recommend_many(
+        self, item_ids, item_type, user_age, seen_ids, top_n=10, weights=None
+    ):
+        """
+        Recommend titles similar to each of several seeds.
+
+        The filters are built once for all the seeds, and the seeds that
+        cannot be served from the candidate cache or the neighbor index are
+        scored together in a single matrix product.
+
+        With the default weights, the ranked titles of the type and age
+        bracket of the request are cached per seed, so that only the titles
+        already rated by the user have to be excluded on the next requests.
+
+        Args:
+            item_ids (list): Ids of the titles used as seeds. Ids missing
+                from the catalog get no recommendations.
+            item_type (str): Type of the recommended titles, "movie" or "tv-show".
+            user_age (int): The age of the user.
+            seen_ids (set): Ids of the titles already rated by the user.
+            top_n (int): Number of titles to recommend per seed. Default is 10.
+            weights (dict): Weight of each embedding component. Default is
+                the weights of the engine. The neighbor index and the
+                candidate cache are only used with the default weights.
+
+        Returns:
+            list: For each seed, the ids of the recommended titles from most
+                to least similar.
+        """
+        catalog = self.catalog
+
+        # Filtrar por tipo, idade e itens já vistos com máscaras sobre o catálogo
+        allowed = catalog.allowed_mask(item_type, user_age)
+        seen = catalog.seen_mask(seen_ids)
+        candidates = allowed & ~seen
+
+        # O índice de vizinhos e o cache só valem para os pesos padrão
+        default_weights = weights is None or weights == self.engine.weights
+        neighbor_index = self.neighbor_index if default_weights else None
+        cache = self.candidate_cache if default_weights else None
+        if cache is not None and not cache.max_size:
+            cache = None
+        bracket = age_bracket(user_age)
+        depth = max(top_n, self.candidate_depth)
+
+        def unseen(ranked):
+            return ranked[~seen[ranked]][:top_n]
+
+        def store(item_id, ranked, complete):
+            if cache is not None:
+                cache.put((item_id, item_type, bracket), (ranked, complete))
+
+        recommendations = [[] for _ in item_ids]
+        pending = []
+        for position, item_id in enumerate(item_ids):
+            idx = catalog.rows.get(item_id)
+            if idx is None:
+                continue
+
+            # Lista já ordenada e filtrada por tipo e idade para esta semente
+            if cache is not None:
+                entry = cache.get((item_id, item_type, bracket))
+                if entry is not None:
+                    ranked, complete = entry
+                    rows = unseen(ranked)
+                    if len(rows) >= top_n or complete:
+                        recommendations[position] = catalog.ids[rows].tolist()
+                        continue
+
+            # Servir a partir do índice quando os vizinhos guardados bastam
+            if neighbor_index is not None:
+                neighbor_rows, _ = neighbor_index.neighbors(idx)
+                neighbor_rows = neighbor_rows[neighbor_rows != idx]
+                rows = neighbor_rows[candidates[neighbor_rows]][:top_n]
+                if len(rows) >= top_n:
+                    store(item_id, neighbor_rows[allowed[neighbor_rows]][:depth], False)
+                    recommendations[position] = catalog.ids[rows].tolist()
+                    continue
+
+            pending.append((position, item_id, idx))
+
+        # Busca aproximada em um subconjunto do catálogo, se configurada
+        if pending and self.ann_index is not None:
+            for position, item_id, idx in pending:
+                is_allowed = allowed.copy()
+                is_allowed[idx] = False  # Ignorar o próprio filme/série
+                ranked = self.ann_index.search(
+                    self.engine, idx, is_allowed, depth, weights=weights
+                )
+                complete = len(ranked) < depth
+                store(item_id, ranked, complete)
+                rows = unseen(ranked)
+                if len(rows) < top_n and not complete:
+                    is_allowed &= ~seen
+                    rows = self.ann_index.search(
+                        self.engine, idx, is_allowed, top_n, weights=weights
+                    )
+                recommendations[position] = catalog.ids[rows].tolist()
+            pending = []
+
+        if pending:
+            sim_scores = self.engine.similarity_rows(
+                [idx for _, _, idx in pending], weights
+            )
+            for (position, item_id, idx), scores in zip(pending, sim_scores):
+                is_allowed = allowed.copy()
+                is_allowed[idx] = False  # Ignorar o próprio filme/série
+                ranked = top_k_indices(scores, depth, is_allowed)
+                complete = len(ranked) < depth
+                store(item_id, ranked, complete)
+                rows = unseen(ranked)
+                if len(rows) < top_n and not complete:
+                    rows = top_k_indices(scores, top_n, is_allowed & ~seen)
+                recommendations[position] = catalog.ids[rows].tolist()
+
+        return recommendations
+
+    def recommend_profile(
+        self, seeds, item_type, user_age, seen_ids, top_n=10, weights=None
+    ):
+        """
+        Recommend titles similar to a weighted set of seeds, such as the
+        recent ratings of a user.
+
+        The catalog is scored once against the weighted sum of the seeds,
+        instead of once per seed.
+
+        Args:
+            seeds (dict): Weight of each seed title, by id. Titles with a
+                negative weight push similar titles down. Ids missing from
+                the catalog are ignored.
+            item_type (str): Type of the recommended titles, "movie" or "tv-show".
+            user_age (int): The age of the user.
+            seen_ids (set): Ids of the titles already rated by the user.
+            top_n (int): Number of titles to recommend. Default is 10.
+            weights (dict): Weight of each embedding component. Default is
+                the weights of the engine.
+
+        Returns:
+            list: Ids of the recommended titles, from highest to lowest score.
+        """
+        catalog = self.catalog
+        known = [
+            (catalog.rows[item_id], weight)
+            for item_id, weight in seeds.items()
+            if item_id in catalog.rows and weight
+        ]
+        if not any(weight > 0 for _, weight in known):
+            return []
+
+        rows, coefficients = zip(*known)
+        scores = self.engine.profile_scores(list(rows), coefficients, weights)
+
+        candidates = catalog.allowed_mask(item_type, user_age) & ~catalog.seen_mask(
+            seen_ids
+        )
+        candidates[list(rows)] = False  # Ignorar as próprias sementes
+        rows = top_k_indices(scores, top_n, candidates)
+        return catalog.ids[rows].tolist()
+
+
+def load_raw_embedding(resources_dir, name):
+    """
+    Load the original embedding of a component, from `<name>_process.npz`
+    if it was stored as a SciPy sparse matrix or `<name>_process.npy` otherwise.
+    """
+    npz_path = os.path.join(resources_dir, f"{name}_process.npz")
+    if os.path.exists(npz_path):
+        return sparse.load_npz(npz_path)
+    return np.load(os.path.join(resources_dir, f"{name}_process.npy"))
+
+
+def sources_fingerprint(resources_dir):
+    """
+    Get the size and modification time of the original files of the model
+    found in a resources directory.
+
+    Returns:
+        dict: `[size, mtime_ns]` of each file, by file name. It is empty if
+            the directory has no original files, e.g. a published version.
+    """
+    file_names = [CATALOG_FILE]
+    for name in COMPONENTS:
+        npz_name = f"{name}_process.npz"
+        if os.path.exists(os.path.join(resources_dir, npz_name)):
+            file_names.append(npz_name)
+        else:
+            file_names.append(f"{name}_process.npy")
+
+    fingerprint = {}
+    for file_name in file_names:
+        path = os.path.join(resources_dir, file_name)
+        if os.path.exists(path):
+            stat = os.stat(path)
+            fingerprint[file_name] = [stat.st_size, stat.st_mtime_ns]
+    return fingerprint
+
+
+def read_sources(compiled_dir):
+    # Registro ausente: artefatos exportados antes de existir o registro
+    try:
+        with open(os.path.join(compiled_dir, SOURCES_FILE)) as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return None
+
+
+def load_embedding(compiled_dir, name, mmap_mode="r"):
+    # Matrizes esparsas (.npz) não podem ser abertas com memory mapping, mas
+    # ocupam uma fração do tamanho das densas
+    npz_path = os.path.join(compiled_dir, f"{name}.npz")
+    if os.path.exists(npz_path):
+        return sparse.load_npz(npz_path)
+
+    # Embeddings int8 são guardados com um arquivo extra com a escala das linhas
+    values = np.load(os.path.join(compiled_dir, f"{name}.npy"), mmap_mode=mmap_mode)
+    scales_path = os.path.join(compiled_dir, f"{name}_scales.npy")
+    if os.path.exists(scales_path):
+        return QuantizedMatrix(values, np.load(scales_path, mmap_mode=mmap_mode))
+    return values
+
+
+def load_model(
+    resources_dir,
+    mmap_mode="r",
+    ann_backend=None,
+    precision=DEFAULT_PRECISION,
+    compiled=True,
+    cache_size=DEFAULT_CACHE_SIZE,
+):
+    """
+    Load the NLP model from its resources directory.
+
+    The compiled artifacts written by `export_model` are opened memory-mapped
+    and read-only, so processes loading the same files share their pages.
+    Without them the original CSV and `.npy` (or sparse `.npz`) files are
+    parsed and normalized. The original files are also used, with a warning,
+    when they changed since the artifacts were exported.
+
+    Args:
+        resources_dir (str): Path of the NLP resources directory.
+        mmap_mode (str): Mode used to open the compiled artifacts. Default is "r".
+        ann_backend (str): Name of the approximate nearest-neighbor backend
+            to use, one of `ANN_BACKENDS`. Default is None (exact search).
+        precision (str): Precision of the embeddings in memory, "float64",
+            "float32" or "int8". Compiled artifacts in another precision are
+            converted, which copies them out of the memory map. Default is
+            `DEFAULT_PRECISION`.
+        compiled (bool): Whether to use the compiled artifacts when they
+            exist. Set it to False to rebuild the model from the original
+            files. Default is True.
+        cache_size (int): Number of seeds kept in the candidate cache of the
+            model, or 0 to disable it. Default is `DEFAULT_CACHE_SIZE`.
+
+    Returns:
+        NLPModel: The loaded model.
+    """
+    compiled_dir = os.path.join(resources_dir, COMPILED_DIR)
+    compiled = compiled and os.path.isdir(compiled_dir)
+
+    # Artefatos exportados de arquivos originais que mudaram desde então, ou
+    # exportados antes de os arquivos originais serem registrados
+    sources = sources_fingerprint(resources_dir)
+    if compiled:
+        recorded = read_sources(compiled_dir)
+        if sources and recorded != sources:
+            logger.warning(
+                "The compiled NLP artifacts in %s do not match the original "
+                "files, loading the original files: run flask nlp export",
+                compiled_dir,
+            )
+            compiled = False
+        else:
+            sources = recorded
+
+    if compiled:
+        catalog = Catalog(
+            *(
+                np.load(os.path.join(compiled_dir, f"{name}.npy"), mmap_mode=mmap_mode)
+                for name in CATALOG_COLUMNS
+            )
+        )
+        engine = SimilarityEngine(
+            {
+                name: load_embedding(compiled_dir, name, mmap_mode)
+                for name in COMPONENTS
+            },
+            normalized=True,
+            precision=precision,
+        )
+    else:
+        df_netflix_bd = pd.read_csv(os.path.join(resources_dir, CATALOG_FILE))
+        catalog = Catalog.from_frame(df_netflix_bd)
+        engine = SimilarityEngine(
+            {name: load_raw_embedding(resources_dir, name) for name in COMPONENTS},
+            precision=precision,
+        )
+
+    neighbor_index = None
+    neighbors_dir = os.path.join(resources_dir, NEIGHBORS_DIR)
+    if os.path.isdir(neighbors_dir):
+        neighbor_index = NeighborIndex.load(neighbors_dir, mmap_mode=mmap_mode)
+        if not neighbor_index.matches(catalog.ids):
+            neighbor_index = None
+
+    ann_index = None
+    if ann_backend:
+        if ann_backend not in ANN_BACKENDS:
+            raise ValueError(f"Unknown ANN backend: {ann_backend}")
+        ann_dir = os.path.join(resources_dir, ann_backend)
+        if os.path.isdir(ann_dir):
+            ann_index = ANN_BACKENDS[ann_backend].load(ann_dir, mmap_mode=mmap_mode)
+            if not ann_index.matches(catalog.ids):
+                ann_index = None
+
+    return NLPModel(
+        catalog, engine, neighbor_index, ann_index, cache_size, sources=sources
+    )
+
+
+def export_model(model, resources_dir):
+    """
+    Write the catalog and the normalized embeddings of a model as `.npy` files
+    that `load_model` can open memory-mapped. The embeddings are written in
+    the precision of the model; sparse embeddings are written as `.npz`
+    files and stay sparse. The original files the model was built from are
+    recorded with them, to detect that they changed.
+
+    Args:
+        model (NLPModel): The model to export.
+        resources_dir (str): Path of the NLP resources directory.
+
+    Returns:
+        str: Path of the directory with the compiled artifacts.
+    """
+    compiled_dir = os.path.join(resources_dir, COMPILED_DIR)
+    os.makedirs(compiled_dir, exist_ok=True)
+
+    for name in CATALOG_COLUMNS:
+        save_array(
+            os.path.join(compiled_dir, f"{name}.npy"), getattr(model.catalog, name)
+        )
+    for name in COMPONENTS:
+        matrix = model.engine.embeddings[name]
+        path = os.path.join(compiled_dir, f"{name}.npy")
+        scales_path = os.path.join(compiled_dir, f"{name}_scales.npy")
+        sparse_path = os.path.join(compiled_dir, f"{name}.npz")
+        if sparse.issparse(matrix):
+            save_sparse(sparse_path, matrix)
+            stale_paths = (path, scales_path)
+        elif isinstance(matrix, QuantizedMatrix):
+            save_array(path, matrix.values)
+            save_array(scales_path, matrix.scales)
+            stale_paths = (sparse_path,)
+        else:
+            save_array(path, matrix)
+            stale_paths = (scales_path, sparse_path)
+        for stale_path in stale_paths:
+            if os.path.exists(stale_path):
+                os.remove(stale_path)
+
+    sources_path = os.path.join(compiled_dir, SOURCES_FILE)
+    if model.sources is None:
+        if os.path.exists(sources_path):
+            os.remove(sources_path)
+    else:
+        tmp_path = f"{sources_path}.tmp"
+        with open(tmp_path, "w") as f:
+            json.dump(model.sources, f, indent=2, sort_keys=True)
+        os.replace(tmp_path, sources_path)
+
+    return compiled_dir
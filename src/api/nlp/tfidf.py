@@ -0,0 +1,204 @@
+import hashlib
+import os
+
+import joblib
+import numpy as np
+from sklearn.feature_extraction.text import TfidfVectorizer
+
+# Colunas do catálogo combinadas no texto de cada título
+TFIDF_FEATURES = ("title", "director", "cast", "genres")
+
+# Versão do formato salvo; arquivos de outro formato são ajustados de novo
+FORMAT_VERSION = 2
+
+
+def combine_features(values):
+    return " ".join(str(value).lower() for value in values)
+
+
+class TfidfCatalog:
+    """
+    TF-IDF model of the titles of a catalog table, fitted once and reused
+    by the requests until the catalog changes.
+
+    Attributes:
+        ids (numpy.ndarray): Id of the title of each row.
+        matrix (scipy.sparse.csr_matrix): TF-IDF features of each title.
+        vectorizer (TfidfVectorizer): The fitted vectorizer.
+        min_ages (numpy.ndarray): Minimum age required to watch each title.
+        genre_names (list): Distinct genres of the catalog.
+        genre_matrix (numpy.ndarray): Boolean matrix (titles x genres) of the
+            genres of each title.
+        fingerprint (tuple): Summary of the catalog table the model was
+            fitted on, used to detect that it changed.
+        version (str): Hash of the titles and vocabulary of the model. Term
+            vectors built with another version are not comparable.
+        rows (dict): Row of each title id.
+    """
+
+    def __init__(
+        self,
+        ids,
+        matrix,
+        vectorizer,
+        min_ages,
+        genre_names,
+        genre_matrix,
+        fingerprint,
+        version,
+    ):
+        self.ids = ids
+        self.matrix = matrix
+        self.vectorizer = vectorizer
+        self.min_ages = min_ages
+        self.genre_names = genre_names
+        self.genre_matrix = genre_matrix
+        self.fingerprint = fingerprint
+        self.version = version
+        self.format_version = FORMAT_VERSION
+        self.rows = {item_id: row for row, item_id in enumerate(ids.tolist())}
+
+    def __len__(self):
+        return len(self.ids)
+
+    @classmethod
+    def fit(cls, records, fingerprint):
+        """
+        Fit the model on the titles of a catalog.
+
+        Args:
+            records (list): One tuple per title with its id, minimum age and
+                the values of the `TFIDF_FEATURES` columns.
+            fingerprint (tuple): Summary of the catalog table.
+
+        Returns:
+            TfidfCatalog: The fitted model.
+        """
+        ids = np.array([record[0] for record in records], dtype=np.int64)
+        # Títulos sem idade mínima exigem 18 anos
+        min_ages = np.array(
+            [18 if record[1] is None else record[1] for record in records],
+            dtype=np.int16,
+        )
+        features = [record[2:] for record in records]
+
+        # Gêneros de cada título, separados por vírgula na tabela
+        title_genres = [
+            {
+                genre.strip()
+                for genre in (values[TFIDF_FEATURES.index("genres")] or "").split(",")
+                if genre.strip()
+            }
+            for values in features
+        ]
+        genre_names = sorted(set().union(*title_genres))
+        genre_columns = {genre: column for column, genre in enumerate(genre_names)}
+        genre_matrix = np.zeros((len(ids), len(genre_names)), dtype=bool)
+        for row, genres in enumerate(title_genres):
+            genre_matrix[row, [genre_columns[genre] for genre in genres]] = True
+
+        vectorizer = TfidfVectorizer(stop_words="english")
+        matrix = vectorizer.fit_transform(
+            [combine_features(values) for values in features]
+        ).tocsr()
+
+        digest = hashlib.sha1(ids.tobytes())
+        digest.update("\n".join(vectorizer.get_feature_names_out()).encode())
+        digest.update(vectorizer.idf_.tobytes())
+        return cls(
+            ids,
+            matrix,
+            vectorizer,
+            min_ages,
+            genre_names,
+            genre_matrix,
+            tuple(fingerprint),
+            digest.hexdigest(),
+        )
+
+    def profile(self, weights):
+        """
+        Sum some of the titles of the catalog into one profile vector.
+
+        Args:
+            weights (dict): Weight of each title, by id. Ids missing from the
+                catalog are ignored.
+
+        Returns:
+            numpy.ndarray: The weighted sum of the TF-IDF rows of the titles.
+        """
+        known = [
+            (self.rows[item_id], weight)
+            for item_id, weight in weights.items()
+            if item_id in self.rows and weight
+        ]
+        if not known:
+            return np.zeros(self.matrix.shape[1])
+
+        rows, coefficients = zip(*known)
+        return self.matrix[list(rows)].T @ np.asarray(coefficients, dtype=float)
+
+    def scores(self, profile):
+        """
+        Score the catalog against a profile vector.
+
+        Only the sparse catalog matrix and the profile are multiplied, so
+        memory stays linear in the catalog size instead of building the
+        N x N similarity matrix. The TF-IDF rows are L2-normalized, so the
+        score of a profile of several titles is the weighted sum of their
+        cosine similarities.
+
+        Returns:
+            numpy.ndarray: The score of every title of the catalog.
+        """
+        return self.matrix @ profile
+
+    def genre_mask(self, genre):
+        """
+        Get the titles with a genre, matched case-insensitively as part of
+        the genre names (e.g. "action" matches "Action & Adventure").
+
+        Returns:
+            numpy.ndarray: Boolean mask over the rows of the catalog.
+        """
+        genre = genre.lower()
+        columns = [
+            column
+            for column, name in enumerate(self.genre_names)
+            if genre in name.lower()
+        ]
+        return self.genre_matrix[:, columns].any(axis=1)
+
+    def allowed_mask(self, user_age, excluded_ids=()):
+        """
+        Get the titles a user is old enough to watch, except some of them.
+
+        Args:
+            user_age (int): The age of the user.
+            excluded_ids (set): Ids of the titles to leave out, e.g. the
+                ones already rated by the user.
+
+        Returns:
+            numpy.ndarray: Boolean mask over the rows of the catalog.
+        """
+        mask = self.min_ages <= user_age
+        if excluded_ids:
+            mask &= ~np.isin(self.ids, np.fromiter(excluded_ids, dtype=np.int64))
+        return mask
+
+    def save(self, path):
+        """
+        Save the model to a file, replacing the previous one atomically.
+        """
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        tmp_path = f"{path}.tmp"
+        with open(tmp_path, "wb") as f:
+            joblib.dump(self, f)
+        os.replace(tmp_path, path)
+
+    @classmethod
+    def load(cls, path):
+        """
+        Load a model saved with `save`.
+        """
+        return joblib.load(path)
@@ -0,0 +1,90 @@
+import os
+import re
+
+VERSIONS_DIR = "versions"
+CURRENT_FILE = "CURRENT"
+
+_VERSION_NAME = re.compile(r"^[\w.-]+$")
+
+
+def check_version_name(version):
+    """
+    Check that a version name can be used as a directory name.
+
+    Raises:
+        ValueError: If the name is empty or contains other characters than
+            letters, digits, "_", "-" and ".".
+    """
+    if not version or not _VERSION_NAME.match(version) or version in (".", ".."):
+        raise ValueError(f"Invalid NLP artifacts version: {version!r}")
+
+
+def version_dir(resources_dir, version):
+    """
+    Get the directory holding the artifacts of a version.
+
+    Args:
+        resources_dir (str): Path of the NLP resources directory.
+        version (str): Name of the version, or None for the unversioned
+            artifacts stored directly in `resources_dir`.
+
+    Returns:
+        str: Path of the directory of the version.
+    """
+    if version is None:
+        return resources_dir
+    check_version_name(version)
+    return os.path.join(resources_dir, VERSIONS_DIR, version)
+
+
+def current_version(resources_dir):
+    """
+    Get the name of the published version of the NLP artifacts.
+
+    Returns:
+        str: Name of the version, or None if no version was published.
+    """
+    try:
+        with open(os.path.join(resources_dir, CURRENT_FILE)) as f:
+            version = f.read().strip()
+    except FileNotFoundError:
+        return None
+    return version or None
+
+
+def list_versions(resources_dir):
+    """
+    List the versions of the NLP artifacts, oldest name first.
+    """
+    versions_dir = os.path.join(resources_dir, VERSIONS_DIR)
+    if not os.path.isdir(versions_dir):
+        return []
+    return sorted(
+        name
+        for name in os.listdir(versions_dir)
+        if os.path.isdir(os.path.join(versions_dir, name))
+    )
+
+
+def publish_version(resources_dir, version):
+    """
+    Make a version the one loaded by the workers.
+
+    The name is written to the `CURRENT` file with an atomic rename, so a
+    worker never reads a partially written name.
+
+    Args:
+        resources_dir (str): Path of the NLP resources directory.
+        version (str): Name of an existing version.
+
+    Raises:
+        ValueError: If the version does not exist.
+    """
+    if not os.path.isdir(version_dir(resources_dir, version)):
+        raise ValueError(f"Unknown NLP artifacts version: {version}")
+
+    path = os.path.join(resources_dir, CURRENT_FILE)
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, "w") as f:
+        f.write(f"{version}\n")
+    os.replace(tmp_path, path)
@@ -0,0 +1,165 @@
+import datetime
+
+from sqlalchemy import delete
+from sqlalchemy.dialects import postgresql, sqlite
+
+from api import db
+from api.seen_items import RATING_COLUMNS, seen_items
+from api.taste_vectors import lock_taste_vector, update_taste_vector
+from api.tfidf_store import movie_tfidf, serie_tfidf
+
+# TF-IDF models the taste vectors of each item type are built on
+TFIDF_STORES = {"movie": movie_tfidf, "serie": serie_tfidf}
+
+# INSERT with ON CONFLICT support of each database
+INSERTS = {"postgresql": postgresql.insert, "sqlite": sqlite.insert}
+
+# Maximum number of ratings written by one bulk request
+MAX_BULK_RATINGS = 500
+
+
+def rating_insert(item_type):
+    """
+    Get an INSERT into the rating table of an item type that supports
+    `on_conflict_do_update` and `on_conflict_do_nothing`.
+    """
+    model = RATING_COLUMNS[item_type][0]
+    return INSERTS[db.session.get_bind().dialect.name](model)
+
+
+def save_ratings(user_id, item_type, ratings):
+    """
+    Write ratings of a user in one transaction and commit it.
+
+    New and changed ratings are written with a single INSERT ... ON CONFLICT
+    (user_id, title id) DO UPDATE, whatever their number, and removed ones
+    with a single DELETE ... RETURNING. Before them, one query locks the
+    user row and reads their taste vector. When the user has a stored taste
+    vector, it needs the previous ratings of the titles, so they are read
+    under that lock, and the vector is updated when the transaction is
+    committed. A concurrent write of the same user therefore never reads the
+    same previous ratings.
+
+    Args:
+        user_id (int): The ID of the user.
+        item_type (str): "movie" or "serie".
+        ratings (dict): The new rating of each title, by title id. An empty
+            rating removes the rating of the title.
+
+    Returns:
+        list: The ids of the titles whose rating was removed.
+
+    Raises:
+        sqlalchemy.exc.IntegrityError: The user or one of the titles does
+            not exist. The session is not rolled back.
+    """
+    model, item_id = RATING_COLUMNS[item_type]
+    catalog = TFIDF_STORES[item_type].loaded()
+    taste = lock_taste_vector(user_id, item_type, catalog)
+
+    if taste is not None:
+        previous = dict(
+            db.session.query(item_id, model.rating).filter(
+                model.user_id == user_id, item_id.in_(list(ratings))
+            )
+        )
+        update_taste_vector(
+            taste,
+            catalog,
+            {
+                title_id: (previous.get(title_id), rating or None)
+                for title_id, rating in ratings.items()
+            },
+        )
+
+    removed = [title_id for title_id, rating in ratings.items() if not rating]
+    if removed:
+        removed = (
+            db.session.execute(
+                delete(model)
+                .where(model.user_id == user_id, item_id.in_(removed))
+                .returning(item_id)
+                .execution_options(synchronize_session=False)
+            )
+            .scalars()
+            .all()
+        )
+
+    now = datetime.datetime.now()
+    rows = [
+        {"user_id": user_id, item_id.key: title_id, "rating": rating, "date_rated": now}
+        for title_id, rating in ratings.items()
+        if rating
+    ]
+    if rows:
+        insert = rating_insert(item_type).values(rows)
+        db.session.execute(
+            insert.on_conflict_do_update(
+                index_elements=[model.user_id, item_id],
+                set_={
+                    "rating": insert.excluded.rating,
+                    "date_rated": insert.excluded.date_rated,
+                },
+            )
+        )
+
+    db.session.commit()
+    seen_items.invalidate(user_id, item_type)
+    return removed
+
+
+def add_ratings(user_id, item_type, item_ids, rating):
+    """
+    Give the same rating to titles a user has not rated yet, without
+    committing.
+
+    The ratings are written with a single multi-row INSERT ... ON CONFLICT
+    DO NOTHING, so titles the user already rated, or repeated ids, keep
+    their rating. Only the inserted ratings are added to the taste vector of
+    the user.
+
+    Args:
+        user_id (int): The ID of the user.
+        item_type (str): "movie" or "serie".
+        item_ids (list): The ids of the titles.
+        rating (str): The rating given to the titles.
+
+    Returns:
+        list: The ids of the titles that were rated.
+
+    Raises:
+        sqlalchemy.exc.IntegrityError: The user or one of the titles does
+            not exist.
+    """
+    if not item_ids:
+        return []
+
+    model, item_id = RATING_COLUMNS[item_type]
+    catalog = TFIDF_STORES[item_type].loaded()
+    taste = lock_taste_vector(user_id, item_type, catalog)
+    now = datetime.datetime.now()
+    insert = rating_insert(item_type).values(
+        [
+            {
+                "user_id": user_id,
+                item_id.key: title_id,
+                "rating": rating,
+                "date_rated": now,
+            }
+            for title_id in dict.fromkeys(item_ids)
+        ]
+    )
+    added = (
+        db.session.execute(
+            insert.on_conflict_do_nothing(
+                index_elements=[model.user_id, item_id]
+            ).returning(item_id)
+        )
+        .scalars()
+        .all()
+    )
+
+    update_taste_vector(
+        taste, catalog, {title_id: (None, rating) for title_id in added}
+    )
+    return added
@@ -0,0 +1,148 @@
+import os
+import threading
+import time
+from collections import OrderedDict
+
+from api import db
+from api.models import MovieUserRating, SerieUserRating
+
+# Rating model and title id column of each item type
+RATING_COLUMNS = {
+    "movie": (MovieUserRating, MovieUserRating.movie_id),
+    "serie": (SerieUserRating, SerieUserRating.serie_id),
+}
+
+
+# Weight of each rating when the ratings of a user are combined into a profile
+RATING_WEIGHTS = {"Me encanta": 2, "Me gusta": 1, "No me gusta": -1}
+
+
+def load_ratings(user_id, item_type):
+    """
+    Get the ratings of a user for one item type, without caching.
+
+    Returns:
+        dict: The rating of each rated title, by title id.
+    """
+    model, item_id = RATING_COLUMNS[item_type]
+    return dict(
+        db.session.query(item_id, model.rating).filter(model.user_id == user_id)
+    )
+
+
+def recent_ratings(user_id, item_type, limit):
+    """
+    Get the most recent ratings of a user for one item type.
+
+    Args:
+        user_id (int): The ID of the user.
+        item_type (str): "movie" or "serie".
+        limit (int): Maximum number of ratings.
+
+    Returns:
+        list: (title id, rating) tuples, most recent first.
+    """
+    model, item_id = RATING_COLUMNS[item_type]
+    query = (
+        db.session.query(item_id, model.rating)
+        .filter(model.user_id == user_id)
+        .order_by(model.date_rated.desc().nulls_last(), model.id.desc())
+        .limit(limit)
+    )
+    return query.all()
+
+
+class SeenItems:
+    """
+    Loads the titles a user has already rated, for the recommendation endpoints.
+
+    Only the id and rating columns of the requested item type are queried, so
+    no rating objects are built. The results can be cached per user in an LRU
+    of at most `max_users` entries. The rating endpoints must call `invalidate`
+    after they write. Entries also expire after `ttl` seconds, which bounds
+    how stale the cache of another worker process can get.
+
+    Args:
+        max_users (int): Number of (user, item type) entries kept in the
+            cache, or 0 to disable it. Default is 0.
+        ttl (float): Seconds an entry is kept in the cache. Default is 30.
+    """
+
+    def __init__(self, max_users=0, ttl=30):
+        self.max_users = max_users
+        self.ttl = ttl
+        self._cache = OrderedDict()
+        self._lock = threading.Lock()
+        self._invalidations = 0
+
+    def _load(self, user_id, item_type):
+        ratings = load_ratings(user_id, item_type)
+        return ratings, frozenset(ratings)
+
+    def _get(self, user_id, item_type):
+        if not self.max_users:
+            return self._load(user_id, item_type)
+
+        key = (int(user_id), item_type)
+        now = time.monotonic()
+        with self._lock:
+            entry = self._cache.get(key)
+            if entry is not None and entry[0] > now:
+                self._cache.move_to_end(key)
+                return entry[1]
+            invalidations = self._invalidations
+
+        value = self._load(user_id, item_type)
+        with self._lock:
+            # A rating written while loading may be missing from the result
+            if invalidations != self._invalidations:
+                return value
+            self._cache[key] = (now + self.ttl, value)
+            self._cache.move_to_end(key)
+            while len(self._cache) > self.max_users:
+                self._cache.popitem(last=False)
+        return value
+
+    def ratings(self, user_id, item_type):
+        """
+        Get the ratings of a user for one item type.
+
+        Args:
+            user_id (int): The ID of the user.
+            item_type (str): "movie" or "serie".
+
+        Returns:
+            dict: The rating of each rated title, by title id. It may be
+                shared with other callers and must not be modified.
+        """
+        return self._get(user_id, item_type)[0]
+
+    def seen_ids(self, user_id, item_type):
+        """
+        Get the ids of the titles of one item type rated by a user.
+
+        Args:
+            user_id (int): The ID of the user.
+            item_type (str): "movie" or "serie".
+
+        Returns:
+            frozenset: The ids of the rated titles.
+        """
+        return self._get(user_id, item_type)[1]
+
+    def invalidate(self, user_id, item_type=None):
+        """
+        Drop the cached ratings of a user, for one item type or all of them.
+        """
+        item_types = RATING_COLUMNS if item_type is None else (item_type,)
+        with self._lock:
+            self._invalidations += 1
+            for item_type in item_types:
+                self._cache.pop((int(user_id), item_type), None)
+
+
+# Cache of the rated titles, disabled unless SEEN_CACHE_SIZE is set
+seen_items = SeenItems(
+    max_users=int(os.getenv("SEEN_CACHE_SIZE", 0)),
+    ttl=float(os.getenv("SEEN_CACHE_TTL", 30)),
+)
@@ -0,0 +1,142 @@
+from sqlalchemy import and_
+from sqlalchemy.exc import IntegrityError
+
+from api import db
+from api.models import User, UserTasteVector
+from api.seen_items import load_ratings, RATING_WEIGHTS
+
+
+def rating_weight(rating):
+    return RATING_WEIGHTS.get(rating, 0) if rating else 0
+
+
+def lock_user(user_id):
+    """
+    Lock the row of a user until the end of the transaction.
+
+    Taste vectors are only built and updated under this lock, so a rating
+    cannot be written between reading the ratings of a user and storing
+    their vector.
+    """
+    db.session.query(User.id).filter(User.id == user_id).with_for_update().first()
+
+
+def lock_taste_vector(user_id, item_type, catalog):
+    """
+    Lock the row of a user until the end of the transaction, like
+    `lock_user`, and get their stored taste vector in the same query.
+
+    A vector that `catalog` cannot update, because it was built for another
+    version of the model or there is no model, is deleted, to be rebuilt
+    from the ratings on the next recommendation.
+
+    Args:
+        user_id (int): The ID of the user.
+        item_type (str): "movie" or "serie".
+        catalog (TfidfCatalog): The TF-IDF model of the item type, or None.
+
+    Returns:
+        UserTasteVector: The stored vector, or None if the user has none
+            that `catalog` can update.
+    """
+    taste = (
+        db.session.query(UserTasteVector)
+        .select_from(User)
+        .outerjoin(
+            UserTasteVector,
+            and_(
+                UserTasteVector.user_id == User.id,
+                UserTasteVector.item_type == item_type,
+            ),
+        )
+        .filter(User.id == user_id)
+        .with_for_update(of=User)
+        .populate_existing()
+        .first()
+    )
+    if taste is not None and (
+        catalog is None or taste.model_version != catalog.version
+    ):
+        db.session.delete(taste)
+        return None
+    return taste
+
+
+def get_taste_vector(user_id, item_type, catalog):
+    """
+    Get the taste vector of a user: the sum of the TF-IDF rows of the titles
+    they rated, weighted by `RATING_WEIGHTS`.
+
+    The stored vector is used as is, so the cost does not grow with the
+    number of ratings. It is built from the ratings, and stored, when the
+    user has none yet or it was built for another version of the model.
+    The rebuild holds the lock of `lock_user`, like the rating writes.
+
+    Args:
+        user_id (int): The ID of the user.
+        item_type (str): "movie" or "serie".
+        catalog (TfidfCatalog): The current TF-IDF model of the item type.
+
+    Returns:
+        numpy.ndarray: The taste vector, in the term space of the model.
+    """
+    query = UserTasteVector.query.filter_by(user_id=user_id, item_type=item_type)
+    taste = query.first()
+    if taste is not None and taste.model_version == catalog.version:
+        return taste.to_vector(catalog.matrix.shape[1])
+
+    # Another request may have stored the vector while waiting for the lock
+    lock_user(user_id)
+    taste = query.populate_existing().first()
+    if taste is not None and taste.model_version == catalog.version:
+        db.session.commit()
+        return taste.to_vector(catalog.matrix.shape[1])
+
+    vector = catalog.profile(
+        {
+            item_id: rating_weight(rating)
+            for item_id, rating in load_ratings(user_id, item_type).items()
+        }
+    )
+    if taste is None:
+        taste = UserTasteVector(user_id=user_id, item_type=item_type)
+        db.session.add(taste)
+    taste.model_version = catalog.version
+    taste.set_vector(vector)
+    try:
+        db.session.commit()
+    except IntegrityError:
+        # Another request stored the vector of the user first
+        db.session.rollback()
+    return vector
+
+
+def update_taste_vector(taste, catalog, changes):
+    """
+    Apply rating changes to the stored taste vector of a user.
+
+    It must be called in the transaction that writes the ratings, before
+    it is committed, with the vector returned by `lock_taste_vector`. Users
+    without one get it rebuilt from their ratings on their next
+    recommendation instead.
+
+    Args:
+        taste (UserTasteVector): The vector returned by `lock_taste_vector`,
+            or None.
+        catalog (TfidfCatalog): The TF-IDF model given to
+            `lock_taste_vector`.
+        changes (dict): Previous and new rating of each changed title, by
+            id. None stands for no rating (a new or removed rating).
+    """
+    if taste is None:
+        return
+
+    deltas = {
+        item_id: rating_weight(new) - rating_weight(old)
+        for item_id, (old, new) in changes.items()
+    }
+    if not any(deltas.values()):
+        return
+
+    vector = taste.to_vector(catalog.matrix.shape[1]) + catalog.profile(deltas)
+    taste.set_vector(vector)
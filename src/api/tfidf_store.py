@@ -0,0 +1,165 @@
+import hashlib
+import logging
+import os
+import threading
+import time
+
+from api import db
+from api.models import Movie, Serie
+from api.nlp.tfidf import TfidfCatalog, TFIDF_FEATURES, FORMAT_VERSION
+
+logger = logging.getLogger(__name__)
+
+
+class TfidfStore:
+    """
+    Keeps the TF-IDF model of a catalog table in memory and on disk.
+
+    The model is fitted once and saved to `path`. The other processes and
+    the next runs load it from there. It is fitted again only when the
+    fingerprint of the table (number of titles, highest id and a checksum
+    of the fitted columns) no longer matches, which is checked at most every
+    `check_interval` seconds, along with the file, in case another process
+    fitted it again.
+
+    Args:
+        model (db.Model): The catalog model, `Movie` or `Serie`.
+        path (str): Path of the file the model is saved to.
+        check_interval (float): Seconds between checks of the fingerprint.
+            Default is 60.
+    """
+
+    def __init__(self, model, path, check_interval=60):
+        self.model = model
+        self.path = path
+        self.check_interval = check_interval
+        # The model and the time its fingerprint was checked, published
+        # together so the lock-free path never sees one without the other
+        self._loaded = None
+        self._mtime = None
+        self._lock = threading.Lock()
+
+    def _file_mtime(self):
+        try:
+            return os.path.getmtime(self.path)
+        except FileNotFoundError:
+            return None
+
+    def records(self):
+        """
+        Read the columns the model is fitted on, ordered by id.
+
+        Returns:
+            list: One row per title with its id, minimum age and the values
+                of the `TFIDF_FEATURES` columns.
+        """
+        columns = [getattr(self.model, name) for name in TFIDF_FEATURES]
+        return (
+            db.session.query(self.model.id, self.model.min_age, *columns)
+            .order_by(self.model.id)
+            .all()
+        )
+
+    @staticmethod
+    def records_fingerprint(records):
+        # Two tables with the same number of titles and highest id can still
+        # hold different titles, so the content is summed up too
+        digest = hashlib.sha1()
+        for record in records:
+            digest.update(repr(tuple(record)).encode())
+        max_id = records[-1][0] if records else None
+        return (len(records), max_id, digest.hexdigest())
+
+    def fingerprint(self):
+        return self.records_fingerprint(self.records())
+
+    @staticmethod
+    def is_current(catalog, fingerprint):
+        # Models saved in an older format are fitted again
+        return (
+            catalog is not None
+            and catalog.fingerprint == fingerprint
+            and getattr(catalog, "format_version", None) == FORMAT_VERSION
+        )
+
+    def build(self):
+        """
+        Fit the model on the current catalog and save it.
+
+        Returns:
+            TfidfCatalog: The fitted model.
+        """
+        records = self.records()
+        catalog = TfidfCatalog.fit(records, self.records_fingerprint(records))
+        catalog.save(self.path)
+        logger.info("Fitted the TF-IDF model of %s", self.model.__tablename__)
+        return catalog
+
+    def loaded(self):
+        """
+        Get the model without checking it against the table, so it is never
+        fitted: the one in memory, or else the one saved to `path`.
+
+        Used by the rating writes, which only apply changes to taste vectors
+        built with the same version of the model.
+
+        Returns:
+            TfidfCatalog: The model, or None if there is none in a current
+                format.
+        """
+        loaded = self._loaded
+        if loaded is not None:
+            return loaded[0]
+
+        with self._lock:
+            if self._loaded is None:
+                mtime = self._file_mtime()
+                catalog = TfidfCatalog.load(self.path) if mtime is not None else None
+                if getattr(catalog, "format_version", None) != FORMAT_VERSION:
+                    return None
+                # Checked against the table on the next call to `get`
+                self._mtime = mtime
+                self._loaded = (catalog, float("-inf"))
+            return self._loaded[0]
+
+    def get(self):
+        """
+        Get the model of the current catalog, loading or fitting it if needed.
+
+        Returns:
+            TfidfCatalog: The model.
+        """
+        now = time.monotonic()
+        loaded = self._loaded
+        if loaded is not None and now - loaded[1] < self.check_interval:
+            return loaded[0]
+
+        with self._lock:
+            catalog = self._loaded[0] if self._loaded is not None else None
+            fingerprint = self.fingerprint()
+            mtime = self._file_mtime()
+            if (
+                catalog is None
+                or catalog.fingerprint != fingerprint
+                or mtime != self._mtime
+            ):
+                # Another process may have fitted the model again
+                catalog = TfidfCatalog.load(self.path) if mtime is not None else None
+                if not self.is_current(catalog, fingerprint):
+                    catalog = self.build()
+                self._mtime = self._file_mtime()
+            self._loaded = (catalog, now)
+            return catalog
+
+
+# Models saved next to the NLP resources, one file per catalog table
+tfidf_resources_dir = os.path.join(
+    os.path.dirname(os.path.abspath(__file__)), "controllers", "tfidf_resources"
+)
+TFIDF_CHECK_INTERVAL = float(os.getenv("TFIDF_CHECK_INTERVAL", 60))
+movie_tfidf = TfidfStore(
+    Movie, os.path.join(tfidf_resources_dir, "movies.joblib"), TFIDF_CHECK_INTERVAL
+)
+serie_tfidf = TfidfStore(
+    Serie, os.path.join(tfidf_resources_dir, "series.joblib"), TFIDF_CHECK_INTERVAL
+)
@@ -1,4 +1,6 @@
 from flask import jsonify, url_for
+from sqlalchemy import case
+import numpy as np
 
 class APIException(Exception):
     """
@@ -33,6 +35,72 @@ class APIException(Exception):
         return rv
 
 
+# Minimum age required for each age rating of the catalog
+AGE_RESTRICTIONS = {
+    "TV-Y": 0,
+    "TV-Y7": 7,
+    "TV-Y7-FV": 7,
+    "TV-G": 0,
+    "TV-PG": 10,
+    "TV-14": 14,
+    "TV-MA": 17,
+    "G": 0,
+    "PG": 10,
+    "PG-13": 13,
+    "R": 17,
+    "NC-17": 18,
+    "NR": 18,
+    "UR": 18,
+    "": 18,
+}
+
+
+def min_age_expression(age_rating):
+    """
+    Get the SQL expression of the minimum age required by an age rating
+    column, as in `AGE_RESTRICTIONS`. Unknown ratings require 18.
+    """
+    return case(AGE_RESTRICTIONS, value=age_rating, else_=18)
+
+
+def top_k_indices(scores, k, mask=None):
+    """
+    Get the positions of the k highest scores without sorting the whole array.
+
+    The candidates are selected with `numpy.argpartition` and only the
+    selected slice is sorted. Ties are broken by position, so the result is
+    the same as the first k items of a stable descending sort.
+
+    Args:
+        scores (numpy.ndarray): 1-D array of scores.
+        k (int): Number of positions to return.
+        mask (numpy.ndarray): Boolean array selecting the candidate positions.
+            Default is None, meaning every position is a candidate.
+
+    Returns:
+        numpy.ndarray: Positions of the k highest candidate scores, ordered
+            by descending score. Fewer are returned if there are not enough
+            candidates.
+    """
+    candidates = np.arange(len(scores)) if mask is None else np.flatnonzero(mask)
+    candidate_scores = scores[candidates]
+
+    if k <= 0:
+        return candidates[:0]
+
+    if k < len(candidates):
+        top = np.argpartition(-candidate_scores, k - 1)[:k]
+        kth_score = candidate_scores[top].min()
+        above = np.flatnonzero(candidate_scores > kth_score)
+        ties = np.flatnonzero(candidate_scores == kth_score)[: k - len(above)]
+        top = np.concatenate([above, ties])
+    else:
+        top = np.arange(len(candidates))
+
+    order = np.lexsort((top, -candidate_scores[top]))
+    return candidates[top[order]]
+
+
 def has_no_empty_params(rule):
     defaults = rule.defaults if rule.defaults is not None else ()
     arguments = rule.arguments if rule.arguments is not None else ()
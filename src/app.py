@@ -3,17 +3,21 @@ This module takes care of starting the API Server, Loading the DB and Adding the
 """
 
 import os
+import sqlite3
 from flask import Flask, jsonify, send_from_directory
 from flask_migrate import Migrate
 from flask_cors import CORS
 from flask_jwt_extended import JWTManager
 from datetime import timedelta
 from dotenv import load_dotenv
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
 
 from api.utils import APIException, generate_sitemap
 from api import db
 from api.controllers import register_blueprints
 from api.admin import setup_admin
+from api.commands import setup_commands
 
 
 load_dotenv()
@@ -41,8 +45,20 @@ if db_url is not None:
     )
 else:
     app.config["SQLALCHEMY_DATABASE_URI"] = "sqlite:////tmp/test.db"
+
 app.config["SQLALCHEMY_TRACK_MODIFICATIONS"] = False
 
+
+@event.listens_for(Engine, "connect")
+def enable_sqlite_foreign_keys(dbapi_connection, connection_record):
+    # SQLite only checks foreign keys when asked to, and the rating
+    # endpoints rely on them to detect unknown users and titles
+    if isinstance(dbapi_connection, sqlite3.Connection):
+        cursor = dbapi_connection.cursor()
+        cursor.execute("PRAGMA foreign_keys=ON")
+        cursor.close()
+
+
 MIGRATE = Migrate(app, db, compare_type=True)
 db.init_app(app)
 
@@ -55,6 +71,9 @@ setup_admin(app)
 # Add all endpoints from the API
 register_blueprints(app)
 
+# Add the custom flask commands
+setup_commands(app)
+
 # Handle/serialize errors like a JSON object
 @app.errorhandler(APIException)
 def handle_invalid_usage(error):
@@ -1,4 +1,4 @@
 #!/bin/bash
 
 export PYTHONPATH=$PYTHONPATH:./src
-gunicorn src.wsgi:application
+gunicorn --config gunicorn.conf.py src.wsgi:application